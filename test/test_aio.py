@@ -0,0 +1,108 @@
+import asyncio
+import json
+import socket
+import sys
+import time
+from queue import Queue
+
+import yescommander as yc
+from yescommander.aio import HTTPAsyncCommander, JSONStream, SubprocessAsyncCommander
+
+
+def test_json_stream():
+    stream = JSONStream()
+    text = '[{"a": 1}, {"b": [2, 3]}, 45]'
+    ans = []
+    for c in text:
+        ans.extend(stream.feed(c))
+    assert ans == [{"a": 1}, {"b": [2, 3]}, 45]
+    stream = JSONStream()
+    assert stream.feed('{"a": 1}\n{"b"') == [{"a": 1}]
+    assert stream.feed(": 2}\n3") == [{"b": 2}]
+    assert stream.feed("", final=True) == [3]
+
+
+async def _serve(connections, requests):
+    async def handle(reader, writer):
+        connections.append(writer)
+        while True:
+            line = await reader.readline()
+            if line == b"":
+                break
+            requests.append(line.decode().split(" ")[1])
+            while (await reader.readline()) != b"\r\n":
+                pass
+            body = json.dumps(
+                [{"command": f"cmd {i}", "keywords": ["http"]} for i in range(3)]
+            ).encode()
+            half = len(body) // 2
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                + b"%x\r\n%s\r\n%x\r\n%s\r\n0\r\n\r\n"
+                % (half, body[:half], len(body) - half, body[half:])
+            )
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def test_http_commander():
+    connections, requests = [], []
+
+    async def main():
+        server = await _serve(connections, requests)
+        port = server.sockets[0].getsockname()[1]
+        cmdr = HTTPAsyncCommander(f"http://127.0.0.1:{port}/search?q={{query}}")
+        q = Queue()
+        await cmdr.order(["hello", "world"], q)
+        await cmdr.order(["again"], q)
+        first = asyncio.ensure_future(cmdr.order(["slow"], q))
+        cmdr.delay = 0.1
+        await asyncio.sleep(0)
+        await asyncio.gather(first, cmdr.order(["fast"], q))
+        server.close()
+        return q
+
+    q = asyncio.run(main())
+    assert requests == ["/search?q=hello+world", "/search?q=again", "/search?q=fast"]
+    assert len(connections) == 1
+    cmds = [q.get() for _ in range(q.qsize())]
+    assert [str(c) for c in cmds[:3]] == ["cmd 0", "cmd 1", "cmd 2"]
+    assert [c.score for c in cmds[:3]] == [30, 29, 28]
+
+
+def test_subprocess_commander():
+    script = "\n".join(
+        [
+            "import sys, time",
+            "for i in range(1000):",
+            "    print(f'line {i}', flush=True)",
+            "    time.sleep(0.01)",
+        ]
+    )
+    cmdr = SubprocessAsyncCommander([sys.executable, "-c", script, "{query}"])
+    cmdr.max_results = 5
+    q = Queue()
+    t = time.time()
+    asyncio.run(cmdr.order(["go"], q))
+    assert time.time() - t < 2
+    assert [str(q.get()) for _ in range(q.qsize())] == [f"line {i}" for i in range(5)]
+
+    cmdr = SubprocessAsyncCommander([sys.executable, "-c", "print('[1, 2, 3]')"])
+    cmdr.json_records = True
+    cmdr.make_command = lambda record, rank: yc.Soldier([], str(record), "")
+    asyncio.run(cmdr.order(["go"], q))
+    assert [str(q.get()) for _ in range(q.qsize())] == ["1", "2", "3"]
+
+
+def test_unavailable_sources():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    http = HTTPAsyncCommander(f"http://127.0.0.1:{port}/search?q={{query}}")
+    missing = SubprocessAsyncCommander(["yc-missing-program", "{query}"])
+    echo = SubprocessAsyncCommander([sys.executable, "-c", "print('found')"])
+    q = Queue()
+    yc.RunAsyncCommander([http, missing, echo]).order(["go"], q)
+    assert [str(q.get()) for _ in range(q.qsize())] == ["found"]
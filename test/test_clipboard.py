@@ -0,0 +1,27 @@
+import base64
+
+import yescommander as yc
+from yescommander.clipboard import _osc52_sequence
+
+
+def test_osc52_sequence():
+    seq = _osc52_sequence("ls -l")
+    assert seq == "\x1b]52;c;" + base64.b64encode(b"ls -l").decode() + "\x07"
+    tmux = _osc52_sequence("ls -l", tmux=True)
+    assert tmux.startswith("\x1bPtmux;\x1b\x1b]52;c;") and tmux.endswith("\x1b\\")
+
+
+def test_backend_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv("YC_CLIPBOARD", raising=False)
+    monkeypatch.setenv("SSH_TTY", "/dev/pts/0")
+    cache = tmp_path / "clipboard.json"
+    assert yc.Clipboard(cache).backend == "osc52"
+    assert cache.exists()
+    # The cached choice is used while the environment is unchanged.
+    monkeypatch.setattr(yc.Clipboard, "detect", staticmethod(lambda: "xsel"))
+    assert yc.Clipboard(cache).backend == "osc52"
+    monkeypatch.delenv("SSH_TTY")
+    monkeypatch.delenv("SSH_CONNECTION", raising=False)
+    assert yc.Clipboard(cache).backend == "xsel"
+    monkeypatch.setenv("YC_CLIPBOARD", "pbcopy")
+    assert yc.Clipboard(cache).backend == "pbcopy"
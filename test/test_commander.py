@@ -0,0 +1,282 @@
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from queue import Queue
+
+import yescommander as yc
+
+
+def test_file_soldier_preview(tmp_path):
+    text = tmp_path / "a.txt"
+    text.write_text("".join(f"line {i}\n" for i in range(100)))
+    binary = tmp_path / "b.bin"
+    binary.write_bytes(b"\x00\x01\x02" * 100)
+    (tmp_path / "empty").touch()
+
+    fs = yc.FileSoldier([], "a.txt", "", "text", dir=tmp_path)
+    assert fs.preview()["content"] == "".join(f"line {i}\n" for i in range(10))
+    fs = yc.FileSoldier([], str(binary), "", "binary")
+    assert fs.preview()["content"] == "<binary file>"
+    fs = yc.FileSoldier([], "empty", "", "text", dir=tmp_path)
+    assert fs.preview()["content"] == ""
+    fs = yc.FileSoldier([], "missing", "", "text", dir=tmp_path)
+    assert "content" not in fs.preview()
+    # A file truncated after it was stat'ed gives what is left of it.
+    log = tmp_path / "log"
+    log.write_text("rotated\n")
+    head = yc.commander._file_head(str(log), 0, 1 << 20, 10, 4096)
+    assert head == "rotated\n"
+
+
+def test_exec_args():
+    assert yc.commander.split_command("ls -l 'a b'") == ["ls", "-l", "a b"]
+    assert yc.commander.split_command("ls | wc") == ["/bin/sh", "-c", "ls | wc"]
+    assert yc.commander.split_command("A=1 env") == ["/bin/sh", "-c", "A=1 env"]
+    fs = yc.FileSoldier([], "my file.txt", "", "text")
+    assert fs._argv() == ["vim", "my file.txt"]
+    fs = yc.FileSoldier([], "~/notes.md", "", "text")
+    assert fs._argv() == ["vim", os.path.expanduser("~/notes.md")]
+
+
+def _ordered(commander, keywords):
+    q = Queue()
+    commander.order(keywords, q)
+    ans = []
+    while not q.empty():
+        ans.append(str(q.get()))
+    return ans
+
+
+def test_sharded_commander():
+    soldiers = [
+        yc.Soldier.from_dict(
+            {"keywords": [f"kw{i % 7}"], "command": f"cmd {i}"}, score=i
+        )
+        for i in range(100)
+    ]
+    sharded = yc.ShardedCommander(soldiers, processes=2, shard_size=9, min_parallel=0)
+    for keywords in [["kw3"], ["kw", "1"], ["cmd 4"], ["nothing"]]:
+        expected = _ordered(yc.Commander(soldiers), keywords)
+        assert sorted(_ordered(sharded, keywords)) == sorted(expected)
+    sharded.limit = 3
+    assert _ordered(sharded, ["kw3"]) == ["cmd 94", "cmd 87", "cmd 80"]
+    # The pool is kept between orders, and forked processes match on their own.
+    pool = sharded._pool()
+    assert _ordered(sharded, ["kw3"]) == ["cmd 94", "cmd 87", "cmd 80"]
+    assert sharded._pool() is pool
+    assert _forked_order(sharded, ["kw3"]) == ["cmd 94", "cmd 87", "cmd 80"]
+    sharded.close()
+    # Processes other than the owner of the pool fork their own workers.
+    assert list(yc.sharded._fork_map(abs, [-1, -2, -3], 2)) == [1, 3, 2]
+
+
+def test_lazy_commander():
+    built = []
+
+    def factory():
+        time.sleep(0.1)
+        built.append(1)
+        return yc.Commander([yc.Soldier.from_dict({"command": "lazy"})])
+
+    for background in [True, False]:
+        lazy = yc.LazyCommander(
+            factory, name=f"lazy {background}", background=background
+        )
+        assert _ordered(lazy, ["lazy"]) == ["lazy"]
+    assert len(built) == 2
+    assert set(yc.LazyCommander.build_times) >= {"lazy True", "lazy False"}
+
+
+def _forked_order(commander, keywords):
+    ctx = multiprocessing.get_context("fork")
+    q = ctx.Queue()
+    proc = ctx.Process(target=commander.order, args=(keywords, q))
+    proc.start()
+    proc.join()
+    ans = []
+    while not q.empty():
+        ans.append(str(q.get()))
+    return ans
+
+
+def test_lazy_commander_forked():
+    built = []
+
+    def factory():
+        time.sleep(0.2)
+        built.append(1)
+        return yc.Commander([yc.Soldier.from_dict({"command": "lazy"})])
+
+    lazy = yc.LazyCommander(factory, name="lazy forked", background=False)
+    # Search processes skip the commander and leave the build to the parent.
+    assert _forked_order(lazy, ["lazy"]) == []
+    yc.LazyCommander.start_all()
+    assert _forked_order(lazy, ["lazy"]) == []
+    lazy.build()
+    assert _forked_order(lazy, ["lazy"]) == ["lazy"]
+    assert _forked_order(lazy, ["lazy"]) == ["lazy"]
+    assert len(built) == 1
+    assert "lazy forked" in yc.LazyCommander.build_times
+
+
+def test_query():
+    soldiers = [
+        yc.Soldier(["docker", "container"], "docker ps -a", "", 1),
+        yc.Soldier(["git"], "git log --oneline", "", 2),
+        yc.Soldier(["Git", "history"], "tig", "", 3),
+        yc.FileSoldier(["config"], "~/.gitconfig", "", "text", 4),
+    ]
+    sharded = yc.ShardedCommander(soldiers, processes=1)
+    cases = {
+        "git": ["git log --oneline", "tig", "edit ~/.gitconfig"],
+        "Git": ["tig"],
+        "kw:git": ["git log --oneline", "tig"],
+        "cmd:git": ["git log --oneline"],
+        "file:git": ["edit ~/.gitconfig"],
+        "git -log": ["tig", "edit ~/.gitconfig"],
+        "^doc": ["docker ps -a"],
+        "oneline$": ["git log --oneline"],
+        "-a$": ["git log --oneline", "tig", "edit ~/.gitconfig"],
+        "^tig$": ["tig"],
+        "-git -docker": [],
+    }
+    for text, expected in cases.items():
+        keywords = text.split(" ")
+        assert _ordered(yc.Commander(soldiers), keywords) == expected, text
+        assert sorted(_ordered(sharded, keywords)) == sorted(expected), text
+    sharded.close()
+
+
+def test_match_keys_rebuilt():
+    s = yc.Soldier(["git"], "git status", "")
+    assert _ordered(s, ["git"]) == ["git status"]
+    s.keywords = ["vcs"]
+    s.command = "hg status"
+    assert _ordered(s, ["git"]) == []
+    assert _ordered(s, ["vcs"]) == ["hg status"]
+    assert _ordered(pickle.loads(pickle.dumps(s)), ["kw:vcs"]) == ["hg status"]
+    fs = yc.FileSoldier([], "a.txt", "", "text")
+    fs.filename = "b.txt"
+    assert _ordered(fs, ["a.txt"]) == []
+    assert _ordered(fs, ["b.txt"]) == ["edit b.txt"]
+
+
+class _AsyncEcho(yc.BaseAsyncCommander):
+    async def order(self, keywords, queue):
+        queue.put(yc.Soldier.from_dict({"command": "echo " + " ".join(keywords)}))
+
+
+def test_routed_commander():
+    history = yc.Soldier.from_dict({"keywords": ["2"], "command": "history 2"})
+    docker = yc.Soldier.from_dict({"keywords": ["docker"], "command": "docker ps"})
+    router = yc.RoutedCommander([history])
+    router.route(
+        yc.CalculatorSoldier(), predicate=yc.looks_like_formula, exclusive=True
+    )
+    router.route(yc.Commander([docker]), prefix="g")
+    router.route(_AsyncEcho(), prefix="e")
+    router.route(yc.Soldier.from_dict({"command": "debug"}), pattern="^debug$")
+    assert _ordered(router, ["2+3"]) == ["2+3=5"]
+    assert _ordered(router, ["g", "dock"]) == ["docker ps"]
+    assert _ordered(router, ["2"]) == ["history 2"]
+    assert _ordered(router, ["debug"]) == ["debug"]
+    assert _ordered(router, ["e", "hello"]) == ["echo hello"]
+    # A prefix alone does not list all the commands of its route.
+    assert _ordered(router, ["g"]) == []
+    assert not yc.looks_like_formula(["g", "docker"])
+    assert yc.looks_like_formula(["sqrt(2)"])
+    for text in ["git log -3", "head -5", "python3 -m", "x11-utils", "ffmpeg -i a.mp4"]:
+        assert not yc.looks_like_formula(text.split(" ")), text
+    assert yc.looks_like_formula(["2e5*pi"])
+    router.recruit(yc.Soldier(["apt"], "apt install x11-utils", ""))
+    assert _ordered(router, ["x11-utils"]) == ["apt install x11-utils"]
+
+
+class _Slow(yc.Commander):
+    def order(self, keywords, queue):
+        time.sleep(0.3)
+        super().order(keywords, queue)
+
+
+def test_scheduled_commander(tmp_path):
+    fast = yc.Commander([yc.Soldier(["git"], "git status", "")])
+    slow = _Slow([yc.Soldier(["git"], "git log", "")])
+    path = tmp_path / "scheduler.json"
+    sc = yc.ScheduledCommander([slow, fast], budget=0.1, policy="skip", stats_path=path)
+    # The slow child is run first as nothing is known about it, and is abandoned.
+    assert _ordered(sc, ["git"]) == []
+    latency, runs, _ = sc.stats(0)
+    assert runs == 1 and latency >= 0.1
+    # Now it is expected to miss the budget, so it is skipped at once.
+    t0 = time.perf_counter()
+    assert _ordered(sc, ["git"]) == ["git status"]
+    assert time.perf_counter() - t0 < 0.1
+    assert sc.schedule() == [1, 0]
+    # Its expected latency decays while it is skipped, until it is tried again.
+    assert sc.stats(0)[0] < latency
+    for _ in range(10):
+        _ordered(sc, ["git"])
+        if sc.stats(0)[1] == 2:
+            break
+    assert sc.stats(0)[1] == 2
+
+    sc.policy = "background"
+    q = Queue()
+    sc.order(["git"], q)
+    cmds = [q.get() for _ in range(2)]
+    assert [str(c) for c in cmds] == ["git status", "git log"]
+    sc.record_selection(cmds[1])
+    assert sc.stats(0)[2] == 1
+    # The commands of the children are not marked themselves.
+    assert not hasattr(slow._commanders[0], "_yc_origin")
+    sc.save()
+    sc2 = yc.ScheduledCommander([slow, fast], stats_path=path)
+    assert sc2.stats(0) == sc.stats(0)
+
+
+def test_scheduled_commander_async(tmp_path):
+    sc = yc.ScheduledCommander([_AsyncEcho()], stats_path=tmp_path / "s.json")
+    sc.recruit(_AsyncEcho())
+    assert _ordered(sc, ["hi"]) == ["echo hi", "echo hi"]
+    assert sc._names == ["0:_AsyncEcho", "1:_AsyncEcho"]
+
+
+def test_scheduled_commander_unfinished(tmp_path):
+    fast = yc.Commander([yc.Soldier(["git"], "git status", "")])
+    slow = _Slow([yc.Soldier(["git"], "git log", "")])
+    sc = yc.ScheduledCommander(
+        [slow, fast], budget=0.1, stats_path=tmp_path / "scheduler.json"
+    )
+    thread = threading.Thread(target=sc.order, args=(["git"], Queue()), daemon=True)
+    thread.start()
+    time.sleep(0.05)
+    # Were the order terminated now, the slow child would not come first next time.
+    assert sc.stats(0) == [0.1, 0, 0]
+    assert sc.schedule() == [1, 0]
+    thread.join()
+
+
+def test_fuzzy_commander():
+    tree = yc.BKTree(["docker", "kubectl", "dock", "git"])
+    assert sorted(tree.search("dokcer", 2)) == [("docker", 2)]
+    assert yc.levenshtein("kubeclt", "kubectl") == 2
+    soldiers = [
+        yc.Soldier(["docker"], "docker ps", "", score=50),
+        yc.Soldier(["k8s"], "kubectl get pods", "", score=50),
+        yc.Soldier(["git"], "git status", "", score=50),
+    ]
+    fc = yc.FuzzyCommander(soldiers, min_exact=1)
+    q = Queue()
+    fc.order(["dokcer"], q)
+    cmd = q.get()
+    assert q.empty()
+    assert isinstance(cmd, yc.FuzzyMatch) and str(cmd) == "docker ps"
+    assert cmd.score == 30
+    assert cmd.preview()["typos"] == "dokcer ~ docker"
+    assert _ordered(fc, ["kubeclt", "pods"]) == ["kubectl get pods"]
+    assert _ordered(fc, ["kubeclt", "-pods"]) == []
+    # Short words are not corrected, and exact matches are enough.
+    assert _ordered(fc, ["gti"]) == []
+    assert _ordered(fc, ["docker"]) == ["docker ps"]
@@ -0,0 +1,43 @@
+import yescommander as yc
+
+
+def test_frecency_ranking(tmp_path):
+    store = yc.FrecencyStore(tmp_path / "frecency.log")
+    used = yc.Soldier.from_dict({"command": "used"}, score=40)
+    unused = yc.Soldier.from_dict({"command": "unused"}, score=50)
+    for _ in range(5):
+        store.record(used)
+    cmds = sorted([unused, used], key=store.sort_key(), reverse=True)
+    assert cmds == [used, unused]
+
+    reloaded = yc.FrecencyStore(tmp_path / "frecency.log")
+    assert reloaded.boost(used) == store.boost(used)
+    assert reloaded.boost(unused) == 0
+
+
+def test_frecency_compact(tmp_path):
+    path = tmp_path / "frecency.log"
+    store = yc.FrecencyStore(path, max_log_lines=10, max_entries=3)
+    for i in range(11):
+        store.record(yc.Soldier.from_dict({"command": f"cmd {i % 4}"}))
+    assert len(store) <= 3
+    assert len(path.read_text().splitlines()) <= 10
+
+
+def test_frecency_without_str(tmp_path):
+    class Formatted(yc.BaseCommand):
+        score = 50
+
+        def __init__(self, content=""):
+            self.content = content
+
+        def copy_clipboard(self):
+            return self.content
+
+    store = yc.FrecencyStore(tmp_path / "frecency.log")
+    copyable, blank = Formatted("ls"), Formatted()
+    store.record(copyable)
+    store.record(blank)
+    assert len(store) == 1
+    cmds = sorted([blank, copyable], key=store.sort_key(), reverse=True)
+    assert cmds == [copyable, blank]
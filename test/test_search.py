@@ -0,0 +1,87 @@
+import json
+import time
+from pathlib import Path
+
+import yescommander as yc
+from yescommander import xdg
+
+xdg.config_path = Path(__file__).parent / "yc_config"
+
+from yescommander.cli import query_main, yc_rc
+
+
+def test_search(tmp_path):
+    chief = yc_rc.chief_commander
+    cmds = list(yc.search(chief, "ls", limit=3))
+    assert len(cmds) == 3
+    assert list(yc.search(chief, "  ")) == []
+    assert list(yc.search(chief, ["nothing"], timeout=1)) == []
+    frecency = yc.FrecencyStore(tmp_path / "frecency.log")
+    frecency.record(yc.Soldier.from_dict({"command": "cmd 7"}))
+    assert str(next(yc.search(chief, "cmd", frecency=frecency))) == "cmd 7"
+
+
+class _Endless(yc.BaseCommander):
+    def __init__(self):
+        self.puts = 0
+
+    def order(self, keywords, queue):
+        while True:
+            queue.put(yc.Soldier.from_dict({"command": f"cmd {self.puts}"}))
+            self.puts += 1
+            time.sleep(0.01)
+
+
+def test_search_timeout():
+    endless = _Endless()
+    cmds = list(yc.search(endless, "cmd", timeout=0.1))
+    assert len(cmds) > 0
+    # The abandoned order is stopped at its next put.
+    time.sleep(0.1)
+    puts = endless.puts
+    time.sleep(0.1)
+    assert endless.puts == puts
+
+
+def test_query_main(capsys, monkeypatch, tmp_path):
+    monkeypatch.setattr(xdg, "cache_path", tmp_path)
+    query_main(yc_rc.chief_commander, ["ls cmd", "cmd 3"], limit=2)
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(r["query"], r["rank"]) for r in lines] == [
+        ("ls cmd", 0),
+        ("ls cmd", 1),
+        ("cmd 3", 0),
+    ]
+    assert lines[2]["command"] == "cmd 3"
+
+
+def test_dedup():
+    snippet = yc.Soldier(["git"], "git  status", "show the status", score=40)
+    history = yc.Soldier(["history"], "git status", "", score=60)
+    run = yc.RunSoldier(["git"], "git status", "")
+    chief = yc.Commander([snippet, history, run])
+    cmds = list(yc.search(chief, "git"))
+    assert [str(c) for c in cmds] == ["git status", "run: git status"]
+    merged = cmds[0]
+    assert isinstance(merged, yc.MergedCommand)
+    assert merged.score == 60 and merged.best is history
+    assert merged.preview()["description"] == "show the status"
+    assert merged.preview()["keywords"] == "history\ngit"
+
+    class Custom(yc.Soldier):
+        def result(self):
+            pass
+
+    class Snippet(yc.Soldier):
+        _dedup_kind = "cmd"
+
+    chief = yc.Commander(
+        [history, Custom([], "git status", ""), Snippet([], "git status", "")]
+    )
+    cmds = list(yc.search(chief, "git"))
+    assert [type(c) for c in cmds] == [yc.MergedCommand, Custom]
+    yc.Soldier.dedup = False
+    try:
+        assert len(list(yc.search(chief, "git"))) == 3
+    finally:
+        yc.Soldier.dedup = True
@@ -0,0 +1,55 @@
+import os
+
+import yescommander as yc
+from yescommander import viewer
+
+
+def test_resolve(tmp_path, monkeypatch):
+    (tmp_path / "zathura").touch(mode=0o755)
+    monkeypatch.setenv("PATH", str(tmp_path))
+    fv = yc.FileViewer(default="vim %s")
+    fv.update({"pdf": ["evince %s", "zathura %s"], "md": "glow %s"})
+    assert "pdf" not in fv
+    assert fv.resolve("pdf") == "zathura %s"
+    assert fv["pdf"] == "zathura %s"
+    assert fv.resolve("md") == "glow %s"
+    assert fv.resolve("png") == "vim %s"
+    fv.register("png", ["feh %s"])
+    assert fv.resolve("png") == "vim %s"
+
+
+def test_update_file_viewer_cache(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    monkeypatch.setenv("PATH", str(bin_dir))
+    monkeypatch.setattr(viewer, "cache_path", tmp_path)
+    monkeypatch.setattr(viewer, "file_viewer", yc.FileViewer(default="vim %s"))
+    calls = []
+
+    def probe():
+        calls.append(1)
+        return {"pdf": "zathura %s"}
+
+    update = yc.update_file_viewer("cache")(probe)
+    update()
+    update()
+    assert len(calls) == 1
+    assert viewer.file_viewer["pdf"] == "zathura %s"
+    # Installing a program invalidates the cache.
+    (bin_dir / "zathura").touch(mode=0o755)
+    os.utime(bin_dir, ns=(0, 0))
+    update()
+    assert len(calls) == 2
+    update()
+    assert len(calls) == 2
+    # Programs are checked when their file types are resolved.
+    os.utime(bin_dir / "zathura", ns=(1, 1))
+    update()
+    assert len(calls) == 2
+    assert viewer.file_viewer.resolve("pdf") == "zathura %s"
+    assert len(calls) == 3
+    update()
+    assert viewer.file_viewer.resolve("pdf") == "zathura %s"
+    assert len(calls) == 3
+    yc.update_file_viewer("ignore")(probe)()
+    assert len(calls) == 4
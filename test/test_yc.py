@@ -40,3 +40,142 @@ def test_basic(n, end, action, cmd_str):
     assert str(command) == cmd_str
     assert act == action
     inp.close()
+
+
+def test_preview_async():
+    from yescommander import Soldier
+    from yescommander.cli.app import Preview
+
+    class SlowSoldier(Soldier):
+        def preview(self):
+            time.sleep(0.2)
+            return super().preview()
+
+    ready = threading.Event()
+    preview = Preview(width=40, on_ready=ready.set)
+    cmd = SlowSoldier.from_dict({"command": "slow"})
+    preview.update(cmd)
+    assert preview.content.text[0][1] == Preview.loading_text
+    assert ready.wait(2)
+    assert preview.content.text[0][1] == "command"
+    ready.clear()
+    preview.update(SlowSoldier.from_dict({"command": "slow"}))
+    assert preview.content.text[2][1] == "slow"
+    assert not ready.is_set()
+
+
+def test_async_search():
+    import asyncio
+    import types
+
+    import yescommander as yc
+    from yescommander.cli.app import AsyncSearch
+
+    class SlowCommander(yc.BaseCommander):
+        def order(self, keywords, queue):
+            time.sleep(0.1)
+            queue.put(yc.Soldier.from_dict({"command": "ls slow"}))
+
+    updates = []
+    app = types.SimpleNamespace(update=lambda cmds: updates.append(list(cmds)))
+    chief = yc.Commander(
+        [
+            yc.Soldier.from_dict({"command": "ls -l"}),
+            yc.Commander([yc.Soldier.from_dict({"command": "ls -l"})]),
+            SlowCommander(),
+        ]
+    )
+
+    async def main():
+        await AsyncSearch(app, chief).run("ls")
+        task = asyncio.ensure_future(AsyncSearch(app, chief).run("ls"))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+    assert [str(c) for c in updates[1]] == ["ls -l", "ls slow"]
+    assert isinstance(updates[1][0], yc.MergedCommand)
+    # The cancelled search only shows the soldiers.
+    assert [str(c) for c in updates[2]] == ["ls -l"]
+    assert len(updates) == 3
+
+
+def test_worker_memory():
+    import yescommander as yc
+    from yescommander.cli import app
+
+    if app._memory_usage() is None:
+        pytest.skip("/proc/self/smaps_rollup is not available")
+    queue = app._fork.Queue()
+    chief = yc.Commander([yc.Soldier.from_dict({"command": "ls"})])
+    proc = app._fork.Process(target=app._search_worker, args=(chief, ["ls"], queue))
+    proc.start()
+    assert str(queue.get(timeout=5)) == "ls"
+    proc.join()
+    rss, uss, peak_rss, peak_uss = app._worker_memory
+    assert 0 < uss < rss <= peak_rss
+    assert uss <= peak_uss
+
+    # Workers terminated in the middle of their orders are sampled by the parent.
+    class Sleepy(yc.BaseCommander):
+        def order(self, keywords, queue):
+            queue.put(yc.Soldier.from_dict({"command": "sleepy"}))
+            time.sleep(10)
+
+    app._worker_memory[:] = [0] * len(app._worker_memory)
+    proc = app._fork.Process(target=app._search_worker, args=(Sleepy(), ["ls"], queue))
+    proc.start()
+    assert str(queue.get(timeout=5)) == "sleepy"
+    app._record_memory(proc.pid)
+    app._terminate(proc)
+    proc.join(5)
+    assert 0 < app._worker_memory[1] < app._worker_memory[0]
+
+
+def test_config_size(tmp_path):
+    import yescommander as yc
+    from yescommander.cli.app import _config_size
+
+    soldiers = [yc.Soldier.from_dict({"command": f"cmd {i}"}) for i in range(50)]
+    assert _config_size(yc.Commander(soldiers)) == 50
+    sharded = yc.ShardedCommander(soldiers, processes=1)
+    assert _config_size(sharded) == 50
+    sharded.close()
+    assert _config_size(yc.FuzzyCommander(soldiers)) == 50
+    routed = yc.RoutedCommander([yc.Commander(soldiers)])
+    routed.route(yc.Commander(soldiers[:10]), prefix="s")
+    assert _config_size(routed) == 60
+    scheduled = yc.ScheduledCommander(
+        [routed, yc.CalculatorSoldier()], stats_path=tmp_path / "s.json"
+    )
+    assert _config_size(scheduled) == 61
+    lazy = yc.LazyCommander(lambda: yc.Commander(soldiers), background=False)
+    assert _config_size(lazy) > yc.cli.app.YCApplication.async_max_size
+    lazy.build()
+    assert _config_size(lazy) == 50
+
+
+def test_preview_key(tmp_path):
+    import os
+
+    import yescommander as yc
+    from yescommander.cli.app import _preview_key
+
+    for d in ["a", "b"]:
+        (tmp_path / d).mkdir()
+        (tmp_path / d / "notes.md").write_text(d)
+    a = yc.FileSoldier([], "notes.md", "", "text", dir=tmp_path / "a")
+    b = yc.FileSoldier([], "notes.md", "", "text", dir=tmp_path / "b")
+    assert _preview_key(a) != _preview_key(b)
+    key = _preview_key(a)
+    os.utime(tmp_path / "a" / "notes.md", ns=(0, 0))
+    assert _preview_key(a) != key
+
+    s1 = yc.Soldier(["x"], "ls", "one")
+    s2 = yc.Soldier(["x"], "ls", "two")
+    assert _preview_key(s1) != _preview_key(s2)
+    merged = yc.MergedCommand(s1)
+    key = _preview_key(merged)
+    merged.add(s2)
+    assert _preview_key(merged) != key
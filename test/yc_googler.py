@@ -1,21 +1,8 @@
-import asyncio
-import json
 import os
 
 import yescommander as yc
 
 
-async def run(cmd):
-    proc = await asyncio.create_subprocess_shell(
-        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    stdout, stderr = await proc.communicate()
-    try:
-        return json.loads(stdout.decode())
-    except json.JSONDecodeError:
-        return []
-
-
 class ResultCommand(yc.BaseCommand):
     def __init__(self, info, score=20):
         self._str_command = info.pop("title")
@@ -36,19 +23,17 @@ class ResultCommand(yc.BaseCommand):
         return self._preview["url"]
 
 
-class GooglerAsyncCommander(yc.BaseAsyncCommander):
+class GooglerAsyncCommander(yc.SubprocessAsyncCommander):
     delay = 0.2
+    json_records = True
 
     def __init__(self, count=5):
+        super().__init__(
+            ["googler", "--count", str(count), "--json", "{query}"], max_results=count
+        )
         self.count = count
 
-    async def order(self, keywords, queue):
-        await asyncio.sleep(self.delay)
-        kw = " ".join(keywords).strip()
-        if kw == "":
-            return
-        result = await run(f"googler --count {self.count} --json '{kw}'")
-        for i, r in enumerate(result):
-            queue.put(
-                ResultCommand({str(k): str(v) for k, v in r.items()}, score=30 - i)
-            )
+    def make_command(self, record, rank):
+        return ResultCommand(
+            {str(k): str(v) for k, v in record.items()}, score=30 - rank
+        )
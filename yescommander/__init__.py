@@ -14,6 +14,16 @@ else:
     fh.setFormatter(formatter)
     logger.addHandler(fh)
 
+from .aio import *
+from .clipboard import *
 from .commander import *
 from .core import *
+from .dedup import *
+from .frecency import *
+from .fuzzy import *
+from .query import *
+from .scheduler import *
+from .search import *
+from .sharded import *
 from .theme import *
+from .viewer import *
@@ -0,0 +1,431 @@
+"""
+This file includes reusable `BaseAsyncCommander` classes for commanders which fetch
+their commands from external sources.
+"""
+from __future__ import annotations
+
+import asyncio
+import codecs
+import json
+import shlex
+from queue import Queue
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import quote_plus, urlsplit
+
+from . import logger
+from .commander import Soldier
+from .core import BaseAsyncCommander, BaseCommand
+
+__all__ = [
+    "CancellableAsyncCommander",
+    "HTTPAsyncCommander",
+    "SubprocessAsyncCommander",
+]
+
+
+def _soldier_from_record(record: Any, score: int) -> Optional[Soldier]:
+    if isinstance(record, str):
+        return Soldier([], record, "", score) if record.strip() != "" else None
+    if not isinstance(record, dict) or "command" not in record:
+        return None
+    keys = ["keywords", "command", "description"]
+    return Soldier.from_dict({k: record[k] for k in keys if k in record}, score=score)
+
+
+class JSONStream:
+    """
+    `JSONStream` parses JSON values from text fed piece by piece. A top-level array
+    yields its elements one by one as soon as each of them is complete; otherwise
+    whitespace-separated values (e.g. JSON Lines) are yielded.
+    """
+
+    def __init__(self) -> None:
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._in_array: Optional[bool] = None
+
+    def _skip(self, pos: int, chars: str) -> int:
+        while pos < len(self._buf) and self._buf[pos] in chars:
+            pos += 1
+        return pos
+
+    def feed(self, text: str, final: bool = False) -> List[Any]:
+        self._buf += text
+        ans = []
+        pos = 0
+        while True:
+            pos = self._skip(pos, " \t\r\n")
+            if pos == len(self._buf):
+                break
+            if self._in_array is None:
+                self._in_array = self._buf[pos] == "["
+                if self._in_array:
+                    pos += 1
+                    continue
+            if self._in_array:
+                pos = self._skip(pos, " \t\r\n,")
+                if pos < len(self._buf) and self._buf[pos] == "]":
+                    self._in_array = None
+                    pos += 1
+                    continue
+            try:
+                value, end = self._decoder.raw_decode(self._buf, pos)
+            except json.JSONDecodeError:
+                if final:
+                    pos = len(self._buf)
+                break
+            if end == len(self._buf) and not final:
+                break  # A number might be incomplete.
+            ans.append(value)
+            pos = end
+        self._buf = self._buf[pos:]
+        return ans
+
+
+class CancellableAsyncCommander(BaseAsyncCommander):
+    """
+    `CancellableAsyncCommander` runs `search` for each order with a timeout. When a
+    new order arrives while the previous one is still running in the same event
+    loop, the previous one is cancelled. Connection, protocol and missing program
+    errors end the order quietly and are logged to `yc.logger`, so an unavailable
+    source does not disturb other commanders.
+    """
+
+    delay = 0.0  # Wait before searching, so superseded orders do no work at all.
+    timeout: Optional[float] = 10.0
+
+    _task: Optional["asyncio.Task[None]"] = None
+
+    async def search(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        raise NotImplementedError()
+
+    async def _search(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        await self.search(keywords, queue)
+
+    def cancel(self) -> None:
+        """
+        Cancel the running order if it belongs to the running event loop.
+        """
+        task = self._task
+        if task is None or task.done():
+            return
+        try:
+            if task.get_loop() is asyncio.get_running_loop():
+                task.cancel()
+        except RuntimeError:
+            pass
+
+    async def order(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        self.cancel()
+        task = asyncio.ensure_future(self._search(keywords, queue))
+        self._task = task
+        try:
+            await asyncio.wait_for(task, self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        except (OSError, ValueError, EOFError) as e:
+            # EOFError covers `asyncio.IncompleteReadError`.
+            logger.debug("%s failed on %s: %r", type(self).__name__, keywords, e)
+        except asyncio.CancelledError:
+            if self._task is task:
+                raise
+            # Superseded by a newer order.
+
+
+class _ConnectionPool:
+    """
+    Keep-alive connections and per-host semaphores, bound to one event loop.
+    """
+
+    def __init__(self, limit_per_host: int, max_idle: int) -> None:
+        self.limit_per_host = limit_per_host
+        self.max_idle = max_idle
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._idle: Dict[Tuple[str, int, bool], List[Any]] = {}
+        self._semaphores: Dict[Tuple[str, int, bool], asyncio.Semaphore] = {}
+
+    def _check_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Streams and semaphores cannot be shared between event loops.
+            self._loop = loop
+            self._idle = {}
+            self._semaphores = {}
+
+    def semaphore(self, key: Tuple[str, int, bool]) -> asyncio.Semaphore:
+        self._check_loop()
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.limit_per_host)
+        return self._semaphores[key]
+
+    async def acquire(self, key: Tuple[str, int, bool]) -> Tuple[Any, Any, bool]:
+        self._check_loop()
+        idle = self._idle.get(key, [])
+        while len(idle) > 0:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        host, port, ssl = key
+        reader, writer = await asyncio.open_connection(host, port, ssl=ssl)
+        return reader, writer, False
+
+    def release(self, key: Tuple[str, int, bool], reader, writer) -> None:
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.max_idle and asyncio.get_running_loop() is self._loop:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+
+class _ConnectionReset(Exception):
+    pass
+
+
+class HTTPAsyncCommander(CancellableAsyncCommander):
+    """
+    `HTTPAsyncCommander` fetches commands from a HTTP search endpoint. `url` is a
+    template whose `{query}` field is replaced by the quoted keywords. Connections
+    are kept alive and reused as long as the event loop lives, at most
+    `limit_per_host` requests run concurrently for each host, and the JSON body is
+    parsed while it arrives. By default each JSON record is turned into a `Soldier`
+    by `make_command`; override `records` and `make_command` for other APIs.
+
+    Connections are only reused across queries in the "async" search mode of `yc`,
+    where all orders run on the event loop of the application. In the "process" mode
+    each query runs `RunAsyncCommander` with a new event loop in a new process, so
+    every query opens new connections.
+    """
+
+    headers: Dict[str, str] = {}
+    max_idle = 4  # Idle connections kept for each host.
+
+    def __init__(
+        self,
+        url: str,
+        score: int = 30,
+        limit_per_host: int = 4,
+        timeout: Optional[float] = 10.0,
+    ) -> None:
+        self.url_template = url
+        self.score = score
+        self.timeout = timeout
+        self._pool = _ConnectionPool(limit_per_host, self.max_idle)
+
+    def url(self, keywords: List[str]) -> Optional[str]:
+        """
+        Return the URL to be requested, or `None` to skip this order.
+        """
+        query = " ".join(keywords).strip()
+        if query == "":
+            return None
+        return self.url_template.format(query=quote_plus(query))
+
+    def records(self, value: Any) -> Iterable[Any]:
+        """
+        Return the records in a parsed JSON value.
+        """
+        return [value]
+
+    def make_command(self, record: Any, rank: int) -> Optional[BaseCommand]:
+        return _soldier_from_record(record, self.score - rank)
+
+    async def search(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        url = self.url(keywords)
+        if url is None:
+            return
+        stream = JSONStream()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        rank = 0
+
+        def put(values: List[Any]) -> None:
+            nonlocal rank
+            for value in values:
+                for record in self.records(value):
+                    cmd = self.make_command(record, rank)
+                    if cmd is not None:
+                        queue.put(cmd)
+                        rank += 1
+
+        def feed(data: bytes) -> None:
+            put(stream.feed(decoder.decode(data)))
+
+        await self.get(url, feed)
+        put(stream.feed(decoder.decode(b"", final=True), final=True))
+
+    async def get(self, url: str, feed: Callable[[bytes], None]) -> int:
+        """
+        Request `url` and pass the body to `feed` chunk by chunk. Return the status.
+        """
+        parts = urlsplit(url)
+        ssl = parts.scheme == "https"
+        key = (parts.hostname or "", parts.port or (443 if ssl else 80), ssl)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = {
+            "Host": parts.netloc,
+            "Connection": "keep-alive",
+            "Accept": "application/json",
+            "User-Agent": "YesCommander",
+        }
+        headers.update(self.headers)
+        request = f"GET {path} HTTP/1.1\r\n"
+        request += "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+        async with self._pool.semaphore(key):
+            while True:
+                reader, writer, reused = await self._pool.acquire(key)
+                try:
+                    status, keep_alive = await self._exchange(
+                        reader, writer, request.encode(), feed
+                    )
+                except _ConnectionReset:
+                    writer.close()
+                    if reused:
+                        continue  # The server closed an idle connection.
+                    raise ConnectionResetError(url)
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self._pool.release(key, reader, writer)
+                else:
+                    writer.close()
+                return status
+
+    async def _exchange(
+        self, reader, writer, request: bytes, feed: Callable[[bytes], None]
+    ) -> Tuple[int, bool]:
+        writer.write(request)
+        await writer.drain()
+        status_line = await reader.readline()
+        if status_line == b"":
+            raise _ConnectionReset()
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        headers: Dict[str, str] = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if line == "":
+                break
+            k, _, v = line.partition(":")
+            headers[k.strip().lower()] = v.strip()
+        ok = status == "200"
+        keep_alive = headers.get("connection", "").lower() != "close" and (
+            version != "HTTP/1.0"
+            or headers.get("connection", "").lower() == "keep-alive"
+        )
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b""):
+                        pass  # Trailers
+                    break
+                data = await reader.readexactly(size + 2)
+                if ok:
+                    feed(data[:-2])
+        elif "content-length" in headers:
+            remaining = int(headers["content-length"])
+            while remaining > 0:
+                data = await reader.read(min(remaining, 65536))
+                if data == b"":
+                    raise ConnectionResetError()
+                remaining -= len(data)
+                if ok:
+                    feed(data)
+        else:
+            keep_alive = False
+            while True:
+                data = await reader.read(65536)
+                if data == b"":
+                    break
+                if ok:
+                    feed(data)
+        return int(status), keep_alive
+
+
+class SubprocessAsyncCommander(CancellableAsyncCommander):
+    """
+    `SubprocessAsyncCommander` runs an external program for each order and turns its
+    output into commands while the program is still running. `args` is a list of
+    arguments (or a string to be split) whose `{query}` fields are replaced by the
+    keywords. Each line of stdout is a record, or, with `json_records`, each JSON
+    value of stdout. The program is killed as soon as the order is cancelled or
+    `max_results` commands have been produced.
+    """
+
+    json_records = False
+
+    def __init__(
+        self,
+        args: Union[str, List[str]],
+        score: int = 30,
+        max_results: int = 50,
+        timeout: Optional[float] = 10.0,
+    ) -> None:
+        self.args_template = shlex.split(args) if isinstance(args, str) else args
+        self.score = score
+        self.max_results = max_results
+        self.timeout = timeout
+
+    def args(self, keywords: List[str]) -> Optional[List[str]]:
+        """
+        Return the arguments of the program, or `None` to skip this order.
+        """
+        query = " ".join(keywords).strip()
+        if query == "":
+            return None
+        return [a.replace("{query}", query) for a in self.args_template]
+
+    def make_command(self, record: Any, rank: int) -> Optional[BaseCommand]:
+        return _soldier_from_record(record, self.score - rank)
+
+    async def search(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        args = self.args(keywords)
+        if args is None:
+            return
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=2**20,
+        )
+        rank = 0
+
+        def put(records: Iterable[Any]) -> bool:
+            nonlocal rank
+            for record in records:
+                cmd = self.make_command(record, rank)
+                if cmd is not None:
+                    queue.put(cmd)
+                    rank += 1
+                    if rank >= self.max_results:
+                        return False
+            return True
+
+        assert proc.stdout is not None
+        try:
+            if self.json_records:
+                stream = JSONStream()
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                while True:
+                    data = await proc.stdout.read(65536)
+                    final = data == b""
+                    if not put(stream.feed(decoder.decode(data, final), final)):
+                        break
+                    if final:
+                        break
+            else:
+                async for line in proc.stdout:
+                    if not put([line.decode(errors="replace").rstrip("\r\n")]):
+                        break
+        finally:
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+            await proc.wait()
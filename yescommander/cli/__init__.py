@@ -9,20 +9,30 @@ from __future__ import annotations
 import time
 
 STARTUP_t0 = time.time()
-import multiprocessing
+import argparse
+import gc
+import json
 import sys
+from typing import Iterable, Optional
 
 import yescommander as yc
 
 from .. import copy_command, file_viewer, xdg
-from ..commander import DebugSoldier
+from ..commander import DebugSoldier, LazyCommander
+from ..frecency import FrecencyStore
+from ..scheduler import record_selection
+from ..search import search
 from ..theme import theme
 from .utils import init_config_folder
 
-multiprocessing.set_start_method("fork")
 sys.path.insert(0, str(xdg.config_path))
 
 load_rc_t0 = time.time()
+# Commanders live as long as `yc` and are shared with the forked search workers. No
+# collection runs while they are created, so that they are packed without holes, and
+# they are then moved out of the reach of the collector, which would otherwise write
+# to their pages in the workers.
+gc.disable()
 try:
     import yc_rc
 except ModuleNotFoundError as e:
@@ -30,6 +40,9 @@ except ModuleNotFoundError as e:
         init_config_folder()
     else:
         raise e
+finally:
+    gc.freeze()
+    gc.enable()
 load_rc_t = time.time() - load_rc_t0
 
 load_app_t0 = time.time()
@@ -39,7 +52,12 @@ load_app_t = time.time() - load_app_t0
 
 
 def cli_main(chief_commander) -> None:
-    app = init_app(chief_commander)
+    frecency = FrecencyStore()
+    app = init_app(
+        chief_commander,
+        frecency=frecency,
+        search_mode=getattr(yc_rc, "search_mode", "auto"),
+    )
 
     debug_cmd = DebugSoldier()
     chief_commander.recruit(debug_cmd)
@@ -51,20 +69,88 @@ def cli_main(chief_commander) -> None:
             "terminal size": app.terminal_size,
             "file type viewer": file_viewer,
             "layout mode": app.layout_mode,
+            "search mode": app.search_mode,
+            "frecency entries": len(frecency),
         }
     )
     debug_cmd.info["loading time (s)"]["total"] = time.time() - STARTUP_t0
+    debug_cmd.info["loading time (s)"]["lazy commanders"] = LazyCommander.build_times
 
     command, action = app.run()
+    if isinstance(command, DebugSoldier):
+        # The debug soldier may be a copy made by a search worker before the search.
+        command.info["search worker memory (kB)"] = app.worker_memory
+    if action not in ("run", "copy"):
+        command = None
+    record_selection(command)
     if command is None:
         return
+    frecency.record(command)
     if action == "run":
         return command.result()
     if action == "copy":
         return copy_command(command)
 
 
+def query_main(
+    chief_commander,
+    queries: Iterable[str],
+    limit: Optional[int] = 20,
+    timeout: Optional[float] = None,
+) -> None:
+    """
+    Run `queries` without the terminal interface and print the results as JSON Lines.
+    """
+    frecency = FrecencyStore()
+    for query in queries:
+        for rank, cmd in enumerate(
+            search(chief_commander, query, limit, timeout, frecency)
+        ):
+            try:
+                s = str(cmd)
+            except NotImplementedError:
+                s = ""
+            result = {
+                "query": query,
+                "rank": rank,
+                "command": s,
+                "score": cmd.score,
+                "clipboard": cmd.copy_clipboard(),
+            }
+            print(json.dumps(result))
+        sys.stdout.flush()
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="yc_cmd",
+        description="A fully customizable command line searching interface.",
+    )
+    parser.add_argument("--debug", action="store_true", help="write logs to yc.log")
+    parser.add_argument(
+        "--query",
+        nargs="*",
+        metavar="QUERY",
+        help="run queries without the interface and print JSON Lines; "
+        "queries are read from stdin, one per line, if none is given",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=20, help="maximum number of results per query"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None, help="time limit (s) of each query"
+    )
+    return parser.parse_args(argv)
+
+
 def _main():
+    args = _parse_args()
+    if args.query is not None:
+        if len(args.query) > 0:
+            queries: Iterable[str] = args.query
+        else:
+            queries = (line.rstrip("\n") for line in sys.stdin)
+        return query_main(yc_rc.chief_commander, queries, args.limit, args.timeout)
     if hasattr(yc_rc, "main"):
         yc_rc.cli_main()
     else:
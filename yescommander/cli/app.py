@@ -1,12 +1,31 @@
+import asyncio
+import gc
+import math
 import multiprocessing
 import shutil
 import os
+import signal
 import sys
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from functools import partial
-from queue import Empty
-from typing import Any, Dict, List, Optional, Tuple, cast
+from operator import attrgetter
+from queue import Empty, Queue
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
 
 from prompt_toolkit import Application
 from prompt_toolkit.buffer import Buffer
@@ -24,15 +43,50 @@ from prompt_toolkit.layout.layout import Layout
 from prompt_toolkit.output import ColorDepth
 from prompt_toolkit.widgets import Frame
 
-from .. import BaseCommand, theme, xdg
+from .. import BaseCommand, BaseCommander, theme, xdg
+from ..commander import (
+    Commander,
+    FileSoldier,
+    LazyCommander,
+    RoutedCommander,
+    RunAsyncCommander,
+    Soldier,
+)
+from ..dedup import Deduplicator
+from ..frecency import FrecencyStore
+from ..query import compile_query
+from ..scheduler import ScheduledCommander
+from ..search import split_keywords
+from ..sharded import ShardedCommander
+
+
+def _preview_key(cmd: BaseCommand) -> Hashable:
+    if hasattr(cmd, "preview_key"):
+        return cmd.preview_key()
+    return (type(cmd), id(cmd))
 
 
 class Preview(Window):
+    """
+    `Preview` shows the preview of the selected command. Previews are computed by
+    background threads and kept in a LRU cache, so slow `preview` methods do not
+    freeze the UI. A placeholder is shown until the preview is ready, and pending
+    previews are dropped once the selection moves on. Previews are cached by
+    `preview_key` along with their commands, which keeps the identities in the keys
+    valid.
+    """
+
+    cache_size = 256
+    workers = 2
+    sync_timeout = 0.02  # Seconds to wait before showing the placeholder.
+    loading_text = "loading..."
+
     def __init__(
         self,
         width: int,
         height: Optional[int] = None,
         debug_mode: bool = False,
+        on_ready: Optional[Callable[[], None]] = None,
         **kargs: Any,
     ) -> None:
         super().__init__(
@@ -43,10 +97,79 @@ class Preview(Window):
             **kargs,
         )
         self.debug_mode = debug_mode
+        self._on_ready = on_ready
+        self._cache: "OrderedDict[Hashable, Tuple[BaseCommand, Dict[str, str]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self._jobs: "Queue[Tuple[Hashable, BaseCommand, Future]]" = Queue()
+        self._threads: List[threading.Thread] = []
+        self._current: Optional[Hashable] = None
+        self._future: Optional[Future] = None
+
+    def _work(self) -> None:
+        while True:
+            key, cmd, future = self._jobs.get()
+            if key != self._current:
+                future.cancel()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                preview = cmd.preview()
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            with self._lock:
+                self._cache[key] = (cmd, preview)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            future.set_result(preview)
+
+    def _submit(self, key: Hashable, cmd: BaseCommand) -> Future:
+        if len(self._threads) == 0:
+            for _ in range(self.workers):
+                t = threading.Thread(target=self._work, daemon=True)
+                t.start()
+                self._threads.append(t)
+        if self._future is not None:
+            self._future.cancel()
+        self._future = Future()
+        self._jobs.put((key, cmd, self._future))
+        return self._future
+
+    def _ready(self, key: Hashable, cmd: BaseCommand, future: Future) -> None:
+        if future.cancelled() or key != self._current:
+            return
+        exc = future.exception()
+        self._render(cmd, {"preview error": str(exc)} if exc else future.result())
+        if self._on_ready is not None:
+            self._on_ready()
 
     def update(self, cmd: BaseCommand) -> None:
+        key = _preview_key(cmd)
+        with self._lock:
+            self._current = key
+            entry = self._cache.get(key)
+            preview = None if entry is None else entry[1]
+            if entry is not None:
+                self._cache.move_to_end(key)
+        if preview is not None:
+            return self._render(cmd, preview)
+        future = self._submit(key, cmd)
+        try:
+            return self._render(cmd, future.result(timeout=self.sync_timeout))
+        except FutureTimeoutError:
+            pass
+        except CancelledError:
+            return
+        except Exception as e:
+            return self._render(cmd, {"preview error": str(e)})
+        self._render(cmd, {self.loading_text: ""})
+        future.add_done_callback(partial(self._ready, key, cmd))
+
+    def _render(self, cmd: BaseCommand, preview: Dict[str, str]) -> None:
         ans = []
-        for k, v in cmd.preview().items():
+        for k, v in preview.items():
             ans.extend(
                 [(theme.preview.title_color, k), ("", "\n"), ("", v), ("", "\n")]
             )
@@ -63,9 +186,10 @@ class Preview(Window):
 
 
 class ListBoxData:
-    def __init__(self) -> None:
+    def __init__(self, frecency: Optional[FrecencyStore] = None) -> None:
         self.commands: List[BaseCommand] = []
         self._selected: int = 0
+        self.frecency = frecency
 
     def isSelected(self, i: int) -> bool:
         if self._selected is None:
@@ -97,7 +221,10 @@ class ListBoxData:
         return self.commands[self.getSelected()]
 
     def sorted(self) -> None:
-        self.commands = sorted(self.commands, key=lambda x: x.score, reverse=True)
+        key: Callable[[BaseCommand], float] = (
+            attrgetter("score") if self.frecency is None else self.frecency.sort_key()
+        )
+        self.commands = sorted(self.commands, key=key, reverse=True)
 
 
 class ListBox(Window):
@@ -158,6 +285,54 @@ class ListBox(Window):
         self.content.text = FormattedText(t)  # type: ignore
 
 
+_fork = multiprocessing.get_context("fork")
+
+# The memory (kB) of the last search worker and the peaks over all workers, written by
+# the workers.
+_MEMORY_FIELDS = ("rss", "uss", "peak rss", "peak uss")
+_worker_memory = _fork.RawArray("d", len(_MEMORY_FIELDS))
+
+
+def _memory_usage(pid: Union[int, str] = "self") -> Optional[Tuple[float, float]]:
+    # Return the RSS and USS (private pages) of the process in kB.
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fp:
+            fields = {}
+            for line in fp:
+                name, _, value = line.partition(":")
+                if value.endswith("kB\n"):
+                    fields[name] = float(value.split()[0])
+    except OSError:
+        return None
+    return fields["Rss"], fields["Private_Clean"] + fields["Private_Dirty"]
+
+
+def _record_memory(pid: Union[int, str] = "self") -> None:
+    usage = _memory_usage(pid)
+    if usage is not None:
+        _worker_memory[0], _worker_memory[1] = usage
+        _worker_memory[2] = max(_worker_memory[2], usage[0])
+        _worker_memory[3] = max(_worker_memory[3], usage[1])
+
+
+def _search_worker(chief_commander, keywords: List[str], queue) -> None:
+    # Collections would write to the pages of objects shared with the parent, and the
+    # worker does not live long enough to need them.
+    gc.disable()
+    # Lead a new process group, so that subprocesses started by commanders are
+    # terminated together with this worker.
+    os.setpgid(0, 0)
+    chief_commander.order(keywords, queue)
+    _record_memory()
+
+
+def _terminate(proc: multiprocessing.Process) -> None:
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)  # type: ignore
+    except (ProcessLookupError, PermissionError):
+        proc.terminate()
+
+
 class StoppableThread(threading.Thread):
     """Thread class with a stop() method. The thread itself has to check
     regularly for the stopped() condition."""
@@ -177,35 +352,180 @@ class StoppableThread(threading.Thread):
         return self._stop_event.is_set()
 
     def run(self) -> None:
-        searching_text = self._app.textbox_buffer.text
-        keywords = searching_text.strip().split(" ")
-        if len(searching_text.strip()) == 0:
+        keywords = compile_query(split_keywords(self._app.textbox_buffer.text))
+        if len(keywords) == 0:
             self._app.update([])
             return
 
-        queue: "multiprocessing.Queue[BaseCommand]" = multiprocessing.Queue()
-        proc = multiprocessing.Process(
-            target=self.chief_commander.order, args=(keywords, queue)
+        # The search process cannot keep the commanders it builds.
+        LazyCommander.start_all()
+        queue: "multiprocessing.Queue[BaseCommand]" = _fork.Queue()
+        proc = _fork.Process(
+            target=_search_worker, args=(self.chief_commander, keywords, queue)
         )
         proc.start()
-        cmds = []
+        cmds = Deduplicator()
         while not self.stopped():
             updated = False
             try:
                 for i in range(30):
-                    cmds.append(queue.get(False))
+                    cmds.add(queue.get(False))
                     updated = True
             except Empty:
                 if not proc.is_alive():
                     time.sleep(0.1)
                 pass
             if updated:
-                self._app.update(cmds)
-        proc.terminate()
+                self._app.update(cmds.commands)
+        # Most workers are terminated before their orders finish, so they are sampled
+        # here rather than by themselves.
+        if proc.is_alive():
+            _record_memory(proc.pid)  # type: ignore
+        _terminate(proc)
+
+
+def _leaves(commander: BaseCommander) -> Iterator[BaseCommander]:
+    # The commanders under nested `Commander` objects, which are ordered in turn.
+    if type(commander) is Commander:
+        for c in commander._commanders:
+            yield from _leaves(c)
+    else:
+        yield commander
+
+
+def _children(commander: BaseCommander) -> Optional[List[BaseCommander]]:
+    # The children of the wrapping commanders of `yc`, or None for other commanders.
+    if isinstance(commander, (Commander, ScheduledCommander)):
+        return list(commander._commanders)
+    if isinstance(commander, RoutedCommander):
+        ans = list(commander._default)
+        for routes in commander._prefixes.values():
+            ans.extend(c for c, _ in routes)
+        ans.extend(c for _, c, _ in commander._routes)
+        return ans
+    if isinstance(commander, LazyCommander) and commander._commander is not None:
+        return [commander._commander]
+    return None
+
+
+def _config_size(commander: BaseCommander) -> float:
+    # The number of soldiers under `commander`. A `LazyCommander` which is not built
+    # yet is deferred for being expensive, so it is taken as infinitely large.
+    if isinstance(commander, LazyCommander) and commander._commander is None:
+        return math.inf
+    if isinstance(commander, RunAsyncCommander):
+        return len(commander._commands)
+    children = _children(commander)
+    if children is not None:
+        return sum(_config_size(c) for c in children)
+    try:
+        return len(commander)  # type: ignore
+    except TypeError:
+        return 1
+
+
+class _SearchCancelled(Exception):
+    pass
+
+
+class _AsyncQueue:
+    # Collect commands from the event loop and executor threads, and update the app
+    # with them from the event loop.
+    def __init__(self, app: "YCApplication", loop: asyncio.AbstractEventLoop) -> None:
+        self._app = app
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._buffer: List[BaseCommand] = []
+        self._scheduled = False
+        self._results = Deduplicator()
+        self.closed = False
+
+    def put(self, cmd: BaseCommand, *args: Any, **kwargs: Any) -> None:
+        if self.closed:
+            raise _SearchCancelled()
+        with self._lock:
+            self._buffer.append(cmd)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._loop.call_soon_threadsafe(self.flush)
+
+    def flush(self) -> None:
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+            self._scheduled = False
+        if self.closed or len(buffer) == 0:
+            return
+        self._results.extend(buffer)
+        self._app.update(self._results.commands)
+
+
+class AsyncSearch:
+    """
+    `AsyncSearch` runs an order as a task on the event loop of the app, which is
+    cancelled once the searching text changes. Soldiers are matched on the loop in
+    chunks of `chunk_size`, `RunAsyncCommander` objects are awaited on the loop, and
+    other commanders are run in the default executor. Commanders left running in the
+    executor are stopped when they put a command after the cancellation.
+    """
+
+    chunk_size = 256
+
+    def __init__(self, app: "YCApplication", chief_commander: BaseCommander) -> None:
+        self._app = app
+        self._chief_commander = chief_commander
+
+    async def run(self, text: str) -> None:
+        keywords = compile_query(split_keywords(text))
+        if len(keywords) == 0:
+            self._app.update([])
+            return
+        loop = asyncio.get_running_loop()
+        queue = _AsyncQueue(self._app, loop)
+        pending: List["asyncio.Future[Any]"] = []
+        try:
+            for i, c in enumerate(_leaves(self._chief_commander), 1):
+                if isinstance(c, RunAsyncCommander):
+                    pending.append(asyncio.ensure_future(c._order(keywords, queue)))
+                elif isinstance(c, (Soldier, FileSoldier)):
+                    c.order(keywords, queue)
+                else:
+                    pending.append(loop.run_in_executor(None, c.order, keywords, queue))
+                if i % self.chunk_size == 0:
+                    await asyncio.sleep(0)
+            await asyncio.gather(*pending, return_exceptions=True)
+            queue.flush()
+        finally:
+            queue.closed = True
+            for p in pending:
+                p.cancel()
 
 
 class YCApplication(Application[None]):
-    def __init__(self, chief_commander, width: int, height: int, **kargs: Any) -> None:
+    """
+    `YCApplication` searches with `search_mode`: "process" orders in a forked process
+    for each searching text, "async" orders with `AsyncSearch` in this process, and
+    "auto" chooses "async" for configs of at most `async_max_size` soldiers.
+    """
+
+    async_max_size = 2000
+
+    def __init__(
+        self,
+        chief_commander,
+        width: int,
+        height: int,
+        frecency: Optional[FrecencyStore] = None,
+        search_mode: str = "auto",
+        **kargs: Any,
+    ) -> None:
+        if search_mode == "auto":
+            small = _config_size(chief_commander) <= self.async_max_size
+            search_mode = "async" if small else "process"
+        if search_mode not in ("async", "process"):
+            raise ValueError('search_mode could only be "auto", "async" or "process".')
+        self.search_mode = search_mode
+        self._search_task: "Optional[asyncio.Task[None]]" = None
         self.textbox_buffer = Buffer(
             on_text_changed=self.searching_text_changed,
             multiline=False,
@@ -217,7 +537,7 @@ class YCApplication(Application[None]):
             style=f"bg:{theme.searchbox.bg_color}",
         )
         self.debug_mode = "--debug" in sys.argv
-        self.listdata = ListBoxData()
+        self.listdata = ListBoxData(frecency)
         self._chief_commander = chief_commander
         self._max_num = 2
         self.terminal_size = (width, height)
@@ -263,6 +583,7 @@ class YCApplication(Application[None]):
             height=theme.preview.narrow_height,
             style=f"bg:{theme.preview.bg_color} fg:{theme.preview.fg_color}",
             debug_mode=self.debug_mode,
+            on_ready=self.invalidate,
         )
         self.listbox = ListBox(
             width=width,
@@ -284,6 +605,7 @@ class YCApplication(Application[None]):
             height=theme.wide_height,
             style=f"bg:{theme.preview.bg_color} fg:{theme.preview.fg_color}",
             debug_mode=self.debug_mode,
+            on_ready=self.invalidate,
         )
         self.listbox = ListBox(
             width=width - cast(int, self.preview.width),
@@ -308,6 +630,12 @@ class YCApplication(Application[None]):
             return self._init_wide(width, height)
 
     def searching_text_changed(self, buf: Buffer) -> None:
+        if self.search_mode == "async":
+            if self._search_task is not None:
+                self._search_task.cancel()
+            search = AsyncSearch(self, self._chief_commander)
+            self._search_task = self.create_background_task(search.run(buf.text))
+            return
         self._draw_thread.stop()
         if self._draw_thread.is_alive():
             self._draw_thread.join()
@@ -323,8 +651,20 @@ class YCApplication(Application[None]):
             self.preview.update(selection)
         self.invalidate()
 
+    @property
+    def worker_memory(self) -> Dict[str, float]:
+        """
+        Return the memory (kB) of the search workers, which stays small as long as
+        the workers share the pages of the parent.
+        """
+        if self.search_mode != "process" or _worker_memory[0] == 0:
+            return {}
+        return dict(zip(_MEMORY_FIELDS, _worker_memory))
+
     def stop_draw(self) -> None:
         self._draw_thread.stop()
+        if self._search_task is not None:
+            self._search_task.cancel()
 
 
 _color_depth = {
@@ -373,12 +713,16 @@ def bind_keys(app):
         kb.add(keys)(previous_1)
 
 
-def init_app(chief_commander, input=None, output=None):
+def init_app(
+    chief_commander, input=None, output=None, frecency=None, search_mode="auto"
+):
     terminal_size = shutil.get_terminal_size((80, 20))
     app = YCApplication(
         chief_commander,
         terminal_size.columns,
         terminal_size.lines,
+        frecency=frecency,
+        search_mode=search_mode,
         color_depth=_color_depth[theme.color_depth],
         input=input,
         output=output,
@@ -0,0 +1,165 @@
+"""
+This file implements the clipboard of `yc`. The backend is detected once for each
+environment and the choice is cached under `xdg.cache_path`.
+"""
+from __future__ import annotations
+
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from . import xdg
+
+__all__ = ["Clipboard", "copy_text"]
+
+# Commands of helper processes which read the content from stdin.
+_HELPERS: Dict[str, List[str]] = {
+    "wl-copy": ["wl-copy"],
+    "xclip": ["xclip", "-selection", "clipboard"],
+    "xsel": ["xsel", "--clipboard", "--input"],
+    "pbcopy": ["pbcopy"],
+}
+BACKENDS = ("osc52", *_HELPERS, "pyperclip")
+
+
+def _osc52_sequence(text: str, tmux: bool = False) -> str:
+    seq = "\x1b]52;c;" + base64.b64encode(text.encode()).decode() + "\x07"
+    if tmux:
+        # tmux passes the sequence through to the outer terminal.
+        seq = "\x1bPtmux;" + seq.replace("\x1b", "\x1b\x1b") + "\x1b\\"
+    return seq
+
+
+class Clipboard:
+    """
+    `Clipboard` copies text with one of `BACKENDS`:
+
+    - "osc52": the OSC 52 escape sequence written to the terminal, which works over SSH
+      if the terminal supports it.
+    - "wl-copy", "xclip", "xsel", "pbcopy": a helper process in its own session. It is
+      not waited for, so copying returns at once.
+    - "pyperclip": the `pyperclip` package.
+
+    OSC 52 is chosen in SSH sessions or when there is no helper. The choice is cached in
+    `cache_file` along with the environment it is made in. The environment variable
+    `YC_CLIPBOARD` overrides it.
+    """
+
+    env_var = "YC_CLIPBOARD"
+
+    def __init__(self, cache_file: Optional[Path] = None) -> None:
+        self.cache_file = (
+            xdg.cache_path / "clipboard.json"
+            if cache_file is None
+            else Path(cache_file)
+        )
+        self._backend: Optional[str] = None
+
+    @staticmethod
+    def fingerprint() -> str:
+        """
+        Return the environment variables which the choice of backend depends on.
+        """
+        ssh = "SSH_TTY" in os.environ or "SSH_CONNECTION" in os.environ
+        keys = ["WAYLAND_DISPLAY", "DISPLAY", "TMUX", "PATH"]
+        return json.dumps([sys.platform, ssh] + [os.environ.get(k) for k in keys])
+
+    @staticmethod
+    def detect() -> str:
+        if "SSH_TTY" in os.environ or "SSH_CONNECTION" in os.environ:
+            return "osc52"
+        if sys.platform == "win32":
+            return "pyperclip"
+        candidates = ["pbcopy"] if sys.platform == "darwin" else []
+        if "WAYLAND_DISPLAY" in os.environ:
+            candidates.append("wl-copy")
+        if "DISPLAY" in os.environ:
+            candidates += ["xclip", "xsel"]
+        for name in candidates:
+            if shutil.which(name) is not None:
+                return name
+        return "osc52"
+
+    @property
+    def backend(self) -> str:
+        override = os.environ.get(self.env_var)
+        if override in BACKENDS:
+            return override  # type: ignore
+        if self._backend is None:
+            self._backend = self._load_backend()
+        return self._backend
+
+    def _load_backend(self) -> str:
+        fingerprint = self.fingerprint()
+        try:
+            with self.cache_file.open() as fp:
+                cache = json.load(fp)
+            if cache["fingerprint"] == fingerprint and cache["backend"] in BACKENDS:
+                return cache["backend"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        backend = self.detect()
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with self.cache_file.open("w") as fp:
+                json.dump({"fingerprint": fingerprint, "backend": backend}, fp)
+        except OSError:
+            pass
+        return backend
+
+    def copy(self, text: str) -> None:
+        backend = self.backend
+        if backend == "osc52":
+            self._osc52(text)
+        elif backend == "pyperclip":
+            self._pyperclip(text)
+        else:
+            try:
+                self._helper(_HELPERS[backend], text)
+            except OSError:
+                # The helper is gone, so detect the backend again next time.
+                self._backend = None
+                if self.cache_file.exists():
+                    self.cache_file.unlink()
+                self._pyperclip(text)
+
+    def _osc52(self, text: str) -> None:
+        seq = _osc52_sequence(text, "TMUX" in os.environ)
+        try:
+            with open("/dev/tty", "w") as tty:
+                tty.write(seq)
+        except OSError:
+            sys.stdout.write(seq)
+            sys.stdout.flush()
+
+    def _helper(self, args: List[str], text: str) -> None:
+        proc = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        assert proc.stdin is not None
+        with proc.stdin:
+            proc.stdin.write(text.encode())
+
+    def _pyperclip(self, text: str) -> None:
+        import pyperclip  # type: ignore
+
+        pyperclip.copy(text)
+
+
+_clipboard = Clipboard()
+
+
+def copy_text(text: str) -> None:
+    """
+    Copy `text` to the clipboard.
+    """
+    _clipboard.copy(text)
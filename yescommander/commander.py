@@ -4,69 +4,88 @@ This file includes most basic `Commander` classes.
 from __future__ import annotations
 
 import asyncio
-import json
 import math
 import os
+import re
+import shlex
+import stat
+import sys
+import threading
+import time
+import weakref
+from functools import lru_cache
 from pathlib import Path
 from pprint import pprint
 from queue import Queue
-from typing import Any, Dict, List, Optional, Type, TypeVar, Union
-
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+
+from .clipboard import copy_text
 from .core import BaseAsyncCommander, BaseCommand, BaseCommander
-from .xdg import cache_path
+from .query import MatchKeys, compile_query
+from .viewer import file_viewer, update_file_viewer
 
 __all__ = [
     "CalculatorSoldier",
     "Commander",
     "DebugSoldier",
     "FileSoldier",
+    "LazyCommander",
+    "RoutedCommander",
     "RunSoldier",
     "Soldier",
     "RunAsyncCommander",
     "inject_command",
+    "looks_like_formula",
     "copy_command",
+    "exec_command",
     "file_viewer",
     "update_file_viewer",
 ]
 
 
-file_viewer = {"default": "vim %s"}
-# This `file_viewer` stores commands to open different types of files.
-
-
-def update_file_viewer(mode: str = "cache"):
-    def w(func):
-        def c():
-            viewer_cache = cache_path / "viewer.json"
-            if mode == "cache":
-                if viewer_cache.exists():
-                    with viewer_cache.open() as fp:
-                        file_viewer.update(json.load(fp))
-                    return
-            elif mode == "ignore":
-                pass
-            else:
-                raise ValueError('mode could only be "cache" or "ignore".')
-            file_viewer.update(func())
-            viewer_cache.parent.mkdir(parents=True, exist_ok=True)
-            with viewer_cache.open("w") as fp:
-                json.dump(file_viewer, fp)
-
-        return c
-
-    return w
-
-
-def find_kws_cmd(input_words: List[str], keywords: List[str], command: str) -> bool:
-    for k in input_words:
-        findQ = False
-        for kw in keywords:
-            if k in kw:
-                findQ = True
-        if findQ or (k in command):
-            continue
-        return False
-    return True
+@lru_cache(maxsize=256)
+def _file_head(
+    filename: str, mtime: int, size: int, max_lines: int, max_bytes: int
+) -> str:
+    # `mtime` and `size` are only used as a part of the cache key.
+    if size == 0:
+        return ""
+    with open(filename, "rb") as fp:
+        # A plain read, since a memory map of a file truncated meanwhile would crash
+        # the process with SIGBUS.
+        head = fp.read(min(size, max_bytes))
+    if head.find(b"\0", 0, 1024) != -1:
+        return "<binary file>"
+    end = 0
+    for _ in range(max_lines):
+        end = head.find(b"\n", end) + 1
+        if end == 0:
+            end = len(head)
+            break
+    return head[:end].decode(errors="replace")
+
+
+def file_head(filename: str, max_lines: int = 10, max_bytes: int = 4096) -> str:
+    """
+    Return at most the first `max_lines` lines or `max_bytes` bytes of a file. Only
+    the head of the file is read. Results are cached by the path, modified time and
+    size of the file.
+    """
+    st = os.stat(filename)
+    if not stat.S_ISREG(st.st_mode):
+        raise ValueError(f"{filename} is not a regular file")
+    return _file_head(filename, st.st_mtime_ns, st.st_size, max_lines, max_bytes)
 
 
 def inject_command(cmd: str) -> None:
@@ -79,12 +98,37 @@ def inject_command(cmd: str) -> None:
         print(cmd, file=fp)
 
 
-def copy_command(command) -> None:
-    import pyperclip  # type: ignore
+_SHELL_SYNTAX = re.compile(r"[|&;<>()$`\\*?\[\]{}~\n]|^\s*\w+=")
+
+
+def split_command(cmd: str) -> List[str]:
+    """
+    Split `cmd` into arguments. Commands using shell syntax (pipes, redirections,
+    variables, globs ...) are wrapped into `/bin/sh -c`.
+    """
+    if _SHELL_SYNTAX.search(cmd) is None:
+        args = shlex.split(cmd)
+        if len(args) > 0:
+            return args
+    return ["/bin/sh", "-c", cmd]
+
+
+def exec_command(args: List[str], cwd: Optional[Path] = None) -> None:
+    """
+    Replace the current process with `args` running in `cwd`. This function never
+    returns, so it should only be called when there is nothing left to do.
+    """
+    if cwd is not None:
+        os.chdir(cwd)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execvp(args[0], args)
 
+
+def copy_command(command) -> None:
     content = command.copy_clipboard()
     if len(content) > 0:
-        pyperclip.copy(content)
+        copy_text(content)
         print("Copied")
     return content
 
@@ -98,6 +142,13 @@ class Soldier(BaseCommand, BaseCommander):
     In its `match` function, it yields itself.
     """
 
+    dedup = True  # Merge soldiers with the same command.
+    # Soldiers of the same kind are merged. A subclass is a kind of its own unless it
+    # sets `_dedup_kind` in its body, e.g. to "cmd" to be merged with plain soldiers.
+    _dedup_kind = "cmd"
+    _match_fields = ("keywords", "command")  # Assigning them rebuilds `match_keys`.
+    _match_keys: Optional[MatchKeys] = None
+
     def __init__(
         self, keywords: List[str], command: str, description: str, score: int = 50
     ) -> None:
@@ -105,9 +156,37 @@ class Soldier(BaseCommand, BaseCommander):
         self.command = command
         self.description = description
         self.score = score
+        # Built here so that forked search workers share them with the parent.
+        self._match_keys = self._make_match_keys()
+
+    def _make_match_keys(self) -> MatchKeys:
+        text = self.command if isinstance(self.command, str) else ""
+        return MatchKeys(self.keywords, text, "cmd")
+
+    @property
+    def match_keys(self) -> MatchKeys:
+        """
+        The keys matched against queries, rebuilt on first use after `keywords` or the
+        text is assigned. Mutating `keywords` in place is not noticed, so assign a new
+        list instead.
+        """
+        keys = self._match_keys
+        if keys is None:
+            keys = self._match_keys = self._make_match_keys()
+        return keys
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        if name in self._match_fields:
+            object.__setattr__(self, "_match_keys", None)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.pop("_match_keys", None)  # Rebuilt when used.
+        return state
 
     def order(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
-        if find_kws_cmd(keywords, self.keywords, self.command):
+        if compile_query(keywords).match(self.match_keys):
             queue.put(self)
 
     def __str__(self) -> str:
@@ -124,9 +203,18 @@ class Soldier(BaseCommand, BaseCommander):
             ans["keywords"] = " ".join(self.keywords)
         return ans
 
+    def preview_key(self) -> Hashable:
+        return (type(self), self.command, self.description, tuple(self.keywords))
+
     def result(self) -> None:
         inject_command(self.command)
 
+    def dedup_key(self) -> Optional[Hashable]:
+        if not self.dedup or not isinstance(self.command, str):
+            return None
+        kind = vars(type(self)).get("_dedup_kind", type(self))
+        return (kind, " ".join(self.command.split()))
+
     @classmethod
     def from_dict(
         cls: Type[T], dic: Dict[str, Union[List[str], str]], **kwargs: Any
@@ -143,6 +231,14 @@ class FileSoldier(BaseCommand, BaseCommander):
     `file_viewer` if given keywords are matched with this file's default keywords or its name.
     """
 
+    preview_lines = 10  # The number of lines shown in the preview, 0 for no content.
+    preview_bytes = 4096
+    exec_replace = False  # Replace the `yc` process with the viewer.
+    dedup = True  # Merge file soldiers with the same file.
+    _dedup_kind = "file"  # As for `Soldier`.
+    _match_fields = ("keywords", "filename")
+    _match_keys: Optional[MatchKeys] = None
+
     def __init__(
         self,
         keywords: List[str],
@@ -159,15 +255,52 @@ class FileSoldier(BaseCommand, BaseCommander):
         self.filetype = str(filetype)
         self.score = score
         self.dir = dir  # Change to this path
+        self._match_keys = self._make_match_keys()
+
+    def _make_match_keys(self) -> MatchKeys:
+        return MatchKeys(self.keywords, self.filename, "file")
+
+    match_keys = Soldier.match_keys
+    __setattr__ = Soldier.__setattr__
+    __getstate__ = Soldier.__getstate__
 
     def order(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
-        if find_kws_cmd(keywords, self.keywords, self.filename):
+        if compile_query(keywords).match(self.match_keys):
             queue.put(self)
 
     def _open(self) -> str:
-        if self.filetype in file_viewer:
-            return file_viewer[self.filetype]
-        return file_viewer["default"]
+        return file_viewer.resolve(self.filetype)
+
+    def _path(self) -> str:
+        path = os.path.expanduser(self.filename)
+        if self.dir is not None:
+            path = os.path.join(self.dir, path)
+        return path
+
+    def dedup_key(self) -> Optional[Hashable]:
+        if not self.dedup:
+            return None
+        kind = vars(type(self)).get("_dedup_kind", type(self))
+        return (kind, os.path.normpath(self._path()))
+
+    def preview_key(self) -> Hashable:
+        path = self._path()
+        try:
+            st = os.stat(path)
+            stamp: Tuple[int, int] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = (-1, -1)
+        return (type(self), path, stamp, self.filetype, self.description) + tuple(
+            self.keywords
+        )
+
+    def _argv(self) -> List[str]:
+        viewer = self._open()
+        # Without a shell, "~" is not expanded by anyone else.
+        filename = os.path.expanduser(self.filename)
+        if _SHELL_SYNTAX.search(viewer) is None:
+            return [arg.replace("%s", filename) for arg in shlex.split(viewer)]
+        return ["/bin/sh", "-c", viewer % filename]
 
     def __str__(self) -> str:
         return f"edit {self.filename}"
@@ -184,12 +317,21 @@ class FileSoldier(BaseCommand, BaseCommander):
             ans["dir"] = str(self.dir)
         if len(self.keywords) > 0:
             ans["keywords"] = " ".join(self.keywords)
+        if self.preview_lines > 0:
+            try:
+                ans["content"] = file_head(
+                    self._path(), self.preview_lines, self.preview_bytes
+                )
+            except (OSError, ValueError):
+                pass
         return ans
 
     def copy_clipboard(self) -> str:
         return self.filename
 
     def result(self) -> None:
+        if self.exec_replace:
+            return exec_command(self._argv(), self.dir)
         prev_cwd = Path.cwd()
         dir = prev_cwd if self.dir is None else self.dir
         os.chdir(dir)
@@ -203,8 +345,13 @@ class RunSoldier(Soldier):
     `RunSoldier` will direct run the given command.
     """
 
+    exec_replace = False  # Replace the `yc` process with the command.
+    _dedup_kind = "run"
+
     def result(self) -> None:
         if isinstance(self.command, str):
+            if self.exec_replace:
+                return exec_command(split_command(self.command))
             os.system(self.command)
         else:
             self.command()
@@ -236,6 +383,182 @@ class Commander(BaseCommander):
         self._commanders.append(cmd)
 
 
+class LazyCommander(BaseCommander):
+    """
+    `LazyCommander` defers the construction of an expensive commander to `factory`,
+    which is called in a background thread started at construction when `background`
+    is true, otherwise by the first order reaching this commander. A forked search
+    process cannot keep what it builds, so it skips this commander until the parent
+    process has built it; `yc` calls `LazyCommander.start_all` before forking a search
+    process to start the builds. The build times are recorded in
+    `LazyCommander.build_times`.
+    """
+
+    build_times: Dict[str, float] = {}
+    _instances: "weakref.WeakSet[LazyCommander]" = weakref.WeakSet()
+
+    def __init__(
+        self,
+        factory: Callable[[], BaseCommander],
+        name: Optional[str] = None,
+        background: bool = True,
+    ) -> None:
+        self._factory = factory
+        self.name = (
+            getattr(factory, "__name__", repr(factory)) if name is None else name
+        )
+        self._commander: Optional[BaseCommander] = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._building = False
+        LazyCommander._instances.add(self)
+        if background:
+            self.start()
+
+    def _create(self) -> BaseCommander:
+        t0 = time.time()
+        cmdr = self._factory()
+        LazyCommander.build_times[self.name] = time.time() - t0
+        return cmdr
+
+    def build(self) -> BaseCommander:
+        """
+        Build the commander if it is not built yet, and return it.
+        """
+        with self._lock:
+            if self._commander is None:
+                self._building = True
+                try:
+                    self._commander = self._create()
+                finally:
+                    self._building = False
+        return self._commander
+
+    def start(self) -> None:
+        """
+        Build the commander in a background thread if it is neither built nor being
+        built.
+        """
+        with self._lock:
+            if self._commander is not None or self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._build_started, daemon=True).start()
+
+    def _build_started(self) -> None:
+        try:
+            self.build()
+        finally:
+            self._building = False
+
+    @classmethod
+    def start_all(cls) -> None:
+        """
+        Start building all `LazyCommander` objects which are not built yet.
+        """
+        for cmdr in list(cls._instances):
+            cmdr.start()
+
+    def order(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        cmdr = self._commander
+        if cmdr is None:
+            if os.getpid() != self._pid:
+                return  # Built by the parent process.
+            cmdr = self.build()
+        cmdr.order(keywords, queue)
+
+    def recruit(self, cmd: BaseCommander) -> None:
+        self.build().recruit(cmd)  # type: ignore
+
+
+_FORMULA_CHARS = re.compile(r"[\w.+\-*/%()<>=!&|^~, ]+")
+_FORMULA_OPERATORS = re.compile(r"[+\-*/%()<>=&|^~]")
+_FORMULA_NAMES = re.compile(r"(?<![\w.])[A-Za-z_]\w*")  # Not the "e" of "2e5".
+_MATH_NAMES = frozenset(n for n in vars(math) if not n.startswith("_"))
+
+
+def looks_like_formula(keywords: List[str]) -> bool:
+    """
+    Return whether `keywords` look like a formula for `CalculatorSoldier`, e.g. `2+3`
+    or `sqrt(2)`. Names other than those in `math` are not allowed, so that shell
+    queries such as `git log -3` are not taken for formulas.
+    """
+    text = "".join(keywords)
+    return (
+        _FORMULA_CHARS.fullmatch(text) is not None
+        and _FORMULA_OPERATORS.search(text) is not None
+        and any(c.isdigit() for c in text)
+        and all(n in _MATH_NAMES for n in _FORMULA_NAMES.findall(text))
+    )
+
+
+def _sync(cmdr: Union[BaseCommander, BaseAsyncCommander]) -> BaseCommander:
+    if isinstance(cmdr, BaseAsyncCommander):
+        return RunAsyncCommander([cmdr])
+    return cmdr
+
+
+class RoutedCommander(BaseCommander):
+    """
+    `RoutedCommander` sends each order only to the children whose routes match it,
+    plus a default set. A route is a leading keyword (`prefix`, which is stripped
+    before the order is passed on), a regular expression searched in the searching
+    text (`pattern`) or a function of the keywords (`predicate`). The default set
+    consists of the commanders given at construction or recruited, and it is skipped
+    when an `exclusive` route matches. Prefix routes are exclusive by default, and
+    they are not taken by a prefix alone. `BaseAsyncCommander` children are wrapped in
+    `RunAsyncCommander`.
+    """
+
+    def __init__(self, default: Optional[List[BaseCommander]] = None) -> None:
+        self._default = [] if default is None else [_sync(c) for c in default]
+        self._prefixes: Dict[str, List[Tuple[BaseCommander, bool]]] = {}
+        self._routes: List[Tuple[Callable[[List[str]], bool], BaseCommander, bool]] = []
+
+    def route(
+        self,
+        cmdr: Union[BaseCommander, BaseAsyncCommander],
+        prefix: Optional[str] = None,
+        pattern: Optional[str] = None,
+        predicate: Optional[Callable[[List[str]], bool]] = None,
+        exclusive: Optional[bool] = None,
+    ) -> None:
+        if [prefix, pattern, predicate].count(None) != 2:
+            raise ValueError("Exactly one of prefix, pattern and predicate is needed.")
+        cmdr = _sync(cmdr)
+        if prefix is not None:
+            excl = True if exclusive is None else exclusive
+            self._prefixes.setdefault(prefix, []).append((cmdr, excl))
+            return
+        if pattern is not None:
+            regex = re.compile(pattern)
+
+            def predicate(kws: List[str]) -> bool:
+                return regex.search(" ".join(kws)) is not None
+
+        self._routes.append((predicate, cmdr, bool(exclusive)))  # type: ignore
+
+    def recruit(self, cmd: BaseCommander) -> None:
+        self._default.append(_sync(cmd))
+
+    def order(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        targets: List[Tuple[BaseCommander, List[str]]] = []
+        exclusive = False
+        if len(keywords) > 1 and keywords[0] in self._prefixes:
+            rest = compile_query(keywords[1:])
+            for cmdr, excl in self._prefixes[keywords[0]]:
+                targets.append((cmdr, rest))
+                exclusive |= excl
+        for predicate, cmdr, excl in self._routes:
+            if predicate(keywords):
+                targets.append((cmdr, keywords))
+                exclusive |= excl
+        if not exclusive:
+            targets.extend((cmdr, keywords) for cmdr in self._default)
+        for cmdr, kws in targets:
+            cmdr.order(kws, queue)
+
+
 class RunAsyncCommander(BaseCommander):
     def __init__(self, commands: List[BaseAsyncCommander]) -> None:
         self._commands = commands
@@ -305,5 +628,8 @@ class CalculatorSoldier(BaseCommand, BaseCommander):
     def preview(self):
         return {"answer": str(self.answer)}
 
+    def preview_key(self):
+        return (type(self), str(self.answer))
+
     def result(self):
         inject_command(str(self.answer))
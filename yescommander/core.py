@@ -2,7 +2,7 @@
 This file defines the interfaces of "Command" and three types of "Commanders".
 """
 from queue import Queue
-from typing import Dict, List
+from typing import Dict, Hashable, List, Optional
 
 __all__ = [
     "BaseCommand",
@@ -37,6 +37,19 @@ class BaseCommand:
         """
         ...
 
+    def preview_key(self) -> Hashable:
+        """
+        Return the key of the cached preview, which should change whenever the preview
+        does. The default is the identity of the command.
+        """
+        return (type(self), id(self))
+
+    def dedup_key(self) -> Optional[Hashable]:
+        """
+        Return the key by which commands are deduplicated, or `None` to always list it.
+        """
+        return None
+
     def __str__(self) -> str:
         """
         Return the string for listing.
@@ -0,0 +1,95 @@
+"""
+This file implements the deduplication of the commands given by different commanders.
+"""
+from __future__ import annotations
+
+from functools import partial
+from typing import Any, Dict, Hashable, Iterable, List
+
+from .core import BaseCommand
+
+__all__ = ["Deduplicator", "MergedCommand"]
+
+
+class MergedCommand(BaseCommand):
+    """
+    `MergedCommand` stands for commands with the same `dedup_key`. It is listed, run and
+    copied as the best-scored one, and its preview combines the previews of all of them.
+    Other attributes are looked up on the best-scored command.
+    """
+
+    def __init__(self, command: BaseCommand) -> None:
+        self.commands = [command]
+        self.best = command
+        self.score = command.score
+
+    def add(self, command: BaseCommand) -> None:
+        self.commands.append(command)
+        if command.score > self.score:
+            self.best = command
+            self.score = command.score
+
+    def __getattr__(self, name: str) -> Any:
+        if name in ("commands", "best"):
+            raise AttributeError(name)
+        return getattr(self.best, name)
+
+    def copy_clipboard(self) -> str:
+        return self.best.copy_clipboard()
+
+    def preview(self) -> Dict[str, str]:
+        ans = dict(self.best.preview())
+        for cmd in self.commands:
+            if cmd is not self.best:
+                for k, v in cmd.preview().items():
+                    if k not in ans:
+                        ans[k] = v
+                    elif v not in ans[k]:
+                        ans[k] += "\n" + v
+        ans["sources"] = str(len(self.commands))
+        return ans
+
+    def preview_key(self) -> Hashable:
+        return (MergedCommand,) + tuple(
+            getattr(c, "preview_key", partial(id, c))() for c in self.commands
+        )
+
+    def result(self) -> None:
+        return self.best.result()
+
+    def __str__(self) -> str:
+        return str(self.best)
+
+
+class Deduplicator:
+    """
+    `Deduplicator` collects commands into `commands`, merging those with the same
+    `dedup_key` into a `MergedCommand` through a dictionary index.
+    """
+
+    def __init__(self) -> None:
+        self.commands: List[BaseCommand] = []
+        self._index: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def add(self, command: BaseCommand) -> None:
+        dedup_key = getattr(command, "dedup_key", None)
+        key = None if dedup_key is None else dedup_key()
+        if key is None:
+            self.commands.append(command)
+            return
+        i = self._index.get(key)
+        if i is None:
+            self._index[key] = len(self.commands)
+            self.commands.append(command)
+            return
+        merged = self.commands[i]
+        if not isinstance(merged, MergedCommand):
+            merged = self.commands[i] = MergedCommand(merged)
+        merged.add(command)
+
+    def extend(self, commands: Iterable[BaseCommand]) -> None:
+        for cmd in commands:
+            self.add(cmd)
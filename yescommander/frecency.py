@@ -0,0 +1,142 @@
+"""
+This file implements a frecency store which ranks commands by how frequently and
+how recently they have been selected.
+"""
+from __future__ import annotations
+
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from . import xdg
+from .core import BaseCommand
+
+__all__ = ["FrecencyStore"]
+
+
+def _age_factor(age: float) -> float:
+    if age < 3600:
+        return 1.0
+    if age < 86400:
+        return 0.5
+    if age < 604800:
+        return 0.25
+    return 0.125
+
+
+def _key(command: BaseCommand) -> Optional[str]:
+    # Commands listed with `formatted_str` may not implement `__str__`; they are keyed
+    # by their clipboard content, or not ranked if there is none.
+    try:
+        return str(command)
+    except NotImplementedError:
+        content = command.copy_clipboard()
+        return content if len(content) > 0 else None
+
+
+class FrecencyStore:
+    """
+    `FrecencyStore` records selected commands in an append-only log under
+    `xdg.cache_path`. The log is read into an in-memory index which maps the
+    string of a command to its selection count and last selection time, so the
+    boost of a command is a single dictionary lookup. Once the log grows beyond
+    `max_log_lines` lines, it is compacted into one line per command.
+    """
+
+    weight = 10.0  # Boost of a command selected once within the last hour.
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_log_lines: int = 1000,
+        max_entries: int = 500,
+    ) -> None:
+        self.path = xdg.cache_path / "frecency.log" if path is None else Path(path)
+        self.max_log_lines = max_log_lines
+        self.max_entries = max_entries
+        self._index: Dict[str, List[float]] = {}
+        self._log_lines = 0
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _add(self, key: str, count: float, t: float) -> None:
+        entry = self._index.get(key)
+        if entry is None:
+            self._index[key] = [count, t]
+        else:
+            entry[0] += count
+            entry[1] = max(entry[1], t)
+
+    def load(self) -> None:
+        self._index.clear()
+        self._log_lines = 0
+        if not self.path.exists():
+            return
+        with self.path.open() as fp:
+            for line in fp:
+                try:
+                    t, count, key = json.loads(line)
+                except (ValueError, TypeError):
+                    continue
+                self._add(key, count, t)
+                self._log_lines += 1
+        if self._log_lines > self.max_log_lines:
+            self.compact()
+
+    def record(self, command: BaseCommand) -> None:
+        """
+        Append the selection of `command` to the log.
+        """
+        key, t = _key(command), time.time()
+        if key is None:
+            return
+        self._add(key, 1, t)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as fp:
+            print(json.dumps([t, 1, key]), file=fp)
+        self._log_lines += 1
+        if self._log_lines > self.max_log_lines:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Rewrite the log with one line per command, keeping the `max_entries` commands
+        with the highest frecency.
+        """
+        now = time.time()
+        entries = sorted(
+            self._index.items(),
+            key=lambda kv: self._frecency(kv[1], now),
+            reverse=True,
+        )[: self.max_entries]
+        self._index = dict(entries)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        with tmp.open("w") as fp:
+            for key, (count, t) in entries:
+                print(json.dumps([t, count, key]), file=fp)
+        os.replace(tmp, self.path)
+        self._log_lines = len(entries)
+
+    def _frecency(self, entry: List[float], now: float) -> float:
+        count, t = entry
+        return math.log2(1 + count) * _age_factor(now - t)
+
+    def boost(self, command: BaseCommand, now: Optional[float] = None) -> float:
+        key = _key(command)
+        entry = None if key is None else self._index.get(key)
+        if entry is None:
+            return 0.0
+        return self.weight * self._frecency(entry, time.time() if now is None else now)
+
+    def sort_key(self) -> Callable[[BaseCommand], float]:
+        """
+        Return a key function ranking commands by their scores plus frecency boosts.
+        """
+        now = time.time()
+        return lambda cmd: cmd.score + self.boost(cmd, now)
@@ -0,0 +1,220 @@
+"""
+This file implements `FuzzyCommander`, which tolerates typos in the searching text with
+a BK-tree over the words of its soldiers.
+"""
+from __future__ import annotations
+
+from queue import Queue
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from .commander import FileSoldier, Soldier
+from .core import BaseCommand, BaseCommander
+from .query import SEP, compile_query
+
+__all__ = ["BKTree", "FuzzyCommander", "FuzzyMatch", "levenshtein"]
+
+
+def levenshtein(a: str, b: str) -> int:
+    """
+    Return the edit distance between `a` and `b`.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """
+    `BKTree` stores words by their edit distances to each other, so that the words
+    within a distance of a given word are found by visiting a small part of the tree.
+    """
+
+    def __init__(self, words: Sequence[str] = ()) -> None:
+        self._root: Optional[Tuple[str, Dict[int, Any]]] = None
+        self._size = 0
+        for w in words:
+            self.add(w)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, word: str) -> None:
+        if self._root is None:
+            self._root = (word, {})
+            self._size = 1
+            return
+        node = self._root
+        while True:
+            d = levenshtein(word, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                self._size += 1
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int) -> Iterator[Tuple[str, int]]:
+        """
+        Yield `(w, distance)` for the words `w` within `max_distance` of `word`.
+        """
+        if self._root is None:
+            return
+        stack = [self._root]
+        while stack:
+            w, children = stack.pop()
+            d = levenshtein(word, w)
+            if d <= max_distance:
+                yield w, d
+            for k, child in children.items():
+                if d - max_distance <= k <= d + max_distance:
+                    stack.append(child)
+
+
+class FuzzyMatch(BaseCommand):
+    """
+    `FuzzyMatch` is a soldier matched with typos. Its score is lowered by `penalty` for
+    each edit, and other attributes are looked up on the soldier.
+    """
+
+    def __init__(
+        self, soldier: BaseCommand, distance: int, penalty: float, typos: List[str]
+    ) -> None:
+        self.soldier = soldier
+        self.distance = distance
+        self.score = soldier.score - penalty * distance
+        self.typos = typos
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__") or name == "soldier":
+            raise AttributeError(name)
+        return getattr(self.soldier, name)
+
+    def copy_clipboard(self) -> str:
+        return self.soldier.copy_clipboard()
+
+    def preview(self) -> Dict[str, str]:
+        ans = dict(self.soldier.preview())
+        ans["typos"] = ", ".join(self.typos)
+        return ans
+
+    def preview_key(self) -> Hashable:
+        return (FuzzyMatch, self.soldier.preview_key(), tuple(self.typos))
+
+    def result(self) -> None:
+        return self.soldier.result()
+
+    def __str__(self) -> str:
+        return str(self.soldier)
+
+
+def _words(keys) -> Set[str]:
+    ans = set()
+    for s in (keys.keywords, keys.text):
+        for part in s.lower().split(SEP):
+            ans.update(part.split())
+    return ans
+
+
+class FuzzyCommander(BaseCommander):
+    """
+    `FuzzyCommander` is in charge of a list of `Soldier` or `FileSoldier` objects. It
+    gives the exactly matched soldiers first. If there are fewer than `min_exact` of
+    them, it also gives soldiers whose words are within a few edits (at most
+    `max_distance`, fewer for short words) of the searching words, found with a
+    `BKTree` over the lowercase words of their keywords and texts. Their scores are
+    lowered by `penalty` for each edit.
+    """
+
+    def __init__(
+        self,
+        soldiers: Sequence[Union[Soldier, FileSoldier]],
+        max_distance: int = 2,
+        min_exact: int = 3,
+        penalty: float = 10,
+    ) -> None:
+        self._soldiers = list(soldiers)
+        self.max_distance = max_distance
+        self.min_exact = min_exact
+        self.penalty = penalty
+        self._postings: Dict[str, List[int]] = {}
+        for i, s in enumerate(self._soldiers):
+            for w in _words(s.match_keys):
+                self._postings.setdefault(w, []).append(i)
+        self._tree = BKTree(list(self._postings))
+
+    def __len__(self) -> int:
+        return len(self._soldiers)
+
+    def distance_limit(self, word: str) -> int:
+        """
+        Return the number of edits allowed for `word`.
+        """
+        if len(word) <= 2:
+            return 0
+        if len(word) <= 4:
+            return min(1, self.max_distance)
+        return self.max_distance
+
+    def _lookup(self, word: str) -> Dict[int, Tuple[int, str]]:
+        # Soldier index -> (distance, the closest word) for words with typos.
+        ans: Dict[int, Tuple[int, str]] = {}
+        for w, d in self._tree.search(word, self.distance_limit(word)):
+            if d == 0:
+                continue
+            for i in self._postings[w]:
+                if i not in ans or d < ans[i][0]:
+                    ans[i] = (d, w)
+        return ans
+
+    def order(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        query = compile_query(keywords)
+        n_exact = 0
+        for s in self._soldiers:
+            if query.match(s.match_keys):
+                queue.put(s)
+                n_exact += 1
+        if n_exact >= self.min_exact:
+            return
+        terms = [t for t in query.terms if not t.negate]
+        lookups = [self._lookup(t.needle.strip(SEP).lower()) for t in terms]
+        candidates: Set[int] = set()
+        for lookup in lookups:
+            candidates.update(lookup)
+        for i in sorted(candidates):
+            s = self._soldiers[i]
+            if query.match(s.match_keys):
+                continue
+            distance = 0
+            typos = []
+            for t, lookup in zip(terms, lookups):
+                if t.match(s.match_keys):
+                    continue
+                if i not in lookup:
+                    break
+                d, w = lookup[i]
+                distance += d
+                typos.append(f"{t.needle.strip(SEP)} ~ {w}")
+            else:
+                if all(t.match(s.match_keys) for t in query.terms if t.negate):
+                    queue.put(FuzzyMatch(s, distance, self.penalty, typos))
@@ -0,0 +1,148 @@
+"""
+This file implements the query language of `yc`. The keywords of an order are
+compiled once into a `Query`, which is then matched against the precomputed
+`MatchKeys` of every soldier.
+
+A query is a list of space-separated terms, and a command matches the query if it
+matches all of its terms:
+
+- `word` matches commands with `word` in one of their keywords or in their text
+  (the command of `Soldier` or the file name of `FileSoldier`).
+- `kw:word`, `cmd:word` and `file:word` only look at keywords, commands or file names.
+- `-word` matches commands which do not match `word`.
+- `^word` and `word$` anchor `word` at the start or the end of a keyword or the text.
+- Terms without uppercase letters are case-insensitive (smart-case).
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Optional, Sequence, Tuple
+
+__all__ = ["MatchKeys", "Query", "compile_query"]
+
+FIELDS = ("kw", "cmd", "file")
+SEP = "\x1f"  # Wraps every keyword and the text in `MatchKeys`.
+
+# Indices of `MatchKeys.strings`.
+_ALL, _KW, _TEXT = 0, 2, 4  # Add 1 for the lowercase version.
+
+
+class MatchKeys:
+    """
+    The keys of a command to be matched by a `Query`. `field` is the name of the
+    field of `text`, "cmd" or "file". Every keyword and the text are wrapped in `SEP`
+    and joined into strings, so that all terms, including anchored ones, are matched
+    by substring tests.
+    """
+
+    __slots__ = ("strings", "field")
+
+    def __init__(self, keywords: Sequence[str], text: str, field: str = "cmd") -> None:
+        self._set(SEP + SEP.join(keywords) + SEP, SEP + text + SEP, field)
+
+    def _set(self, keywords: str, text: str, field: str) -> None:
+        kw_lower, text_lower = keywords.lower(), text.lower()
+        self.strings = (
+            keywords + text,
+            kw_lower + text_lower,
+            keywords,
+            kw_lower,
+            text,
+            text_lower,
+        )
+        self.field = field
+
+    @property
+    def keywords(self) -> str:
+        return self.strings[_KW]
+
+    @property
+    def text(self) -> str:
+        return self.strings[_TEXT]
+
+    @classmethod
+    def from_joined(cls, keywords: str, text: str, field: str) -> "MatchKeys":
+        """
+        Build `MatchKeys` from the `keywords` and `text` of another `MatchKeys`.
+        """
+        keys = cls.__new__(cls)
+        keys._set(keywords, text, field)
+        return keys
+
+
+class Term:
+    __slots__ = ("needle", "field", "negate", "case_sensitive")
+
+    def __init__(self, word: str) -> None:
+        self.negate = len(word) > 1 and word.startswith("-")
+        if self.negate:
+            word = word[1:]
+        head, sep, rest = word.partition(":")
+        self.field: Optional[str] = None
+        if sep and head in FIELDS and len(rest) > 0:
+            self.field, word = head, rest
+        start = len(word) > 1 and word.startswith("^")
+        if start:
+            word = word[1:]
+        end = len(word) > 1 and word.endswith("$")
+        if end:
+            word = word[:-1]
+        self.case_sensitive = word != word.lower()
+        if not self.case_sensitive:
+            word = word.lower()
+        self.needle = (SEP if start else "") + word + (SEP if end else "")
+
+    def plan(self) -> Tuple[str, int, Optional[str], bool]:
+        """
+        Return `(needle, index of MatchKeys.strings, required field, negate)`.
+        """
+        if self.field is None:
+            index = _ALL
+        elif self.field == "kw":
+            index = _KW
+        else:
+            index = _TEXT
+        if not self.case_sensitive:
+            index += 1
+        field = None if self.field in (None, "kw") else self.field
+        return self.needle, index, field, self.negate
+
+    def match(self, keys: MatchKeys) -> bool:
+        needle, index, field, negate = self.plan()
+        found = (field is None or field == keys.field) and needle in keys.strings[index]
+        return found != negate
+
+
+class Query(list):
+    """
+    `Query` is the list of keywords of an order, along with its compiled terms. Since
+    it is a list, commanders which expect plain keywords keep working.
+    """
+
+    def __init__(self, keywords: Sequence[str] = ()) -> None:
+        super().__init__(keywords)
+        self.terms = [Term(k) for k in keywords if k != ""]
+        self._plan = [t.plan() for t in self.terms]
+
+    def match(self, keys: MatchKeys) -> bool:
+        strings = keys.strings
+        for needle, index, field, negate in self._plan:
+            if negate == (
+                (field is None or field == keys.field) and needle in strings[index]
+            ):
+                return False
+        return True
+
+
+@lru_cache(maxsize=64)
+def _compile(keywords: Tuple[str, ...]) -> Query:
+    return Query(keywords)
+
+
+def compile_query(keywords: Sequence[str]) -> Query:
+    """
+    Return `keywords` compiled into a `Query`.
+    """
+    if isinstance(keywords, Query):
+        return keywords
+    return _compile(tuple(keywords))
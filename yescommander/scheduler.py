@@ -0,0 +1,217 @@
+"""
+This file implements `ScheduledCommander`, which runs its children by their
+historical latency and usefulness within a latency budget.
+"""
+from __future__ import annotations
+
+import copy
+import json
+import multiprocessing
+import threading
+import time
+import weakref
+from pathlib import Path
+from queue import Queue
+from typing import Any, Dict, List, Optional, Union
+
+from . import xdg
+from .commander import _sync
+from .core import BaseAsyncCommander, BaseCommand, BaseCommander
+
+__all__ = ["ScheduledCommander", "record_selection"]
+
+_LATENCY, _RUNS, _HITS = 0, 1, 2
+_N_STATS = 3
+
+_schedulers: "weakref.WeakSet[ScheduledCommander]" = weakref.WeakSet()
+
+
+def record_selection(command: Optional[BaseCommand]) -> None:
+    """
+    Credit the child which gave the selected `command` (if any) and save the
+    statistics of all `ScheduledCommander` objects.
+    """
+    for scheduler in list(_schedulers):
+        if command is not None:
+            scheduler.record_selection(command)
+        scheduler.save()
+
+
+class _TaggingQueue:
+    # Mark commands with the child which gives them. The mark is set on a shallow copy,
+    # which leaves the commands of the config (and the pages shared with forked search
+    # processes) untouched and travels with the command to the parent process.
+    def __init__(self, queue: "Queue[BaseCommand]", key: int, index: int) -> None:
+        self._queue = queue
+        self._key = key
+        self._index = index
+
+    def put(self, cmd: BaseCommand, *args: Any, **kwargs: Any) -> None:
+        origin = dict(getattr(cmd, "_yc_origin", {}))
+        origin[self._key] = self._index
+        try:
+            tagged = copy.copy(cmd)
+            tagged.__dict__["_yc_origin"] = origin
+        except (AttributeError, TypeError, copy.Error):
+            tagged = cmd
+        self._queue.put(tagged, *args, **kwargs)
+
+
+class ScheduledCommander(BaseCommander):
+    """
+    `ScheduledCommander` is in charge of a list of commanders like `Commander`, but it
+    tracks the latency (moving average) of every child and how often the commands
+    of the child are selected. Children are run in the order of their selection rate
+    per second of latency. Children expected to finish within `budget` seconds of
+    the order are run first. The others are run afterwards if `policy` is
+    "background", or skipped if `policy` is "skip", in which case a child still
+    running at the deadline is abandoned as well. A child without finished runs is
+    expected to take `budget` seconds. The expected latency of a skipped child decays
+    by `skip_decay`, so that it is tried again once in a while.
+
+    The statistics live in shared memory, so they are updated by the forked search
+    processes, and they are saved to `stats_path` under `xdg.cache_path`, keyed by
+    `names` (default: the index and class name of each child). Async children are
+    run with `RunAsyncCommander`.
+    """
+
+    alpha = 0.3  # Weight of the latest latency in the moving average.
+    skip_decay = 0.8
+
+    def __init__(
+        self,
+        commanders: List[Union[BaseCommander, BaseAsyncCommander]],
+        budget: float = 0.2,
+        policy: str = "background",
+        names: Optional[List[str]] = None,
+        stats_path: Optional[Path] = None,
+    ) -> None:
+        if policy not in ("background", "skip"):
+            raise ValueError('policy could only be "background" or "skip".')
+        self._commanders = [_sync(c) for c in commanders]
+        self.budget = budget
+        self.policy = policy
+        self._names = [f"{i}:{type(c).__name__}" for i, c in enumerate(commanders)]
+        if names is not None:
+            self._names[: len(names)] = names
+        self.stats_path = (
+            xdg.cache_path / "scheduler.json"
+            if stats_path is None
+            else Path(stats_path)
+        )
+        self._stats = self._allocate(len(self._commanders))
+        self._load()
+        _schedulers.add(self)
+
+    def _allocate(self, n: int):
+        return multiprocessing.Array("d", max(n, 1) * _N_STATS, lock=False)
+
+    def _load(self) -> None:
+        if not self.stats_path.exists():
+            return
+        try:
+            with self.stats_path.open() as fp:
+                saved = json.load(fp)
+        except (OSError, ValueError):
+            return
+        for i, name in enumerate(self._names):
+            if name in saved:
+                self._stats[i * _N_STATS : (i + 1) * _N_STATS] = saved[name]
+
+    def save(self) -> None:
+        saved: Dict[str, List[float]] = {}
+        if self.stats_path.exists():
+            try:
+                with self.stats_path.open() as fp:
+                    saved = json.load(fp)
+            except (OSError, ValueError):
+                pass
+        saved.update({name: self.stats(i) for i, name in enumerate(self._names)})
+        self.stats_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.stats_path.open("w") as fp:
+            json.dump(saved, fp)
+
+    def stats(self, i: int) -> List[float]:
+        """
+        Return `[latency, runs, hits]` of the `i`th child.
+        """
+        return list(self._stats[i * _N_STATS : (i + 1) * _N_STATS])
+
+    def recruit(self, cmd: Union[BaseCommander, BaseAsyncCommander]) -> None:
+        stats = self._stats[:]
+        self._commanders.append(_sync(cmd))
+        self._names.append(f"{len(self._commanders) - 1}:{type(cmd).__name__}")
+        self._stats = self._allocate(len(self._commanders))
+        self._stats[: len(stats)] = stats
+
+    def record_selection(self, command: BaseCommand) -> None:
+        i = getattr(command, "_yc_origin", {}).get(id(self))
+        if i is not None and i < len(self._commanders):
+            self._stats[i * _N_STATS + _HITS] += 1
+
+    def _record_latency(self, i: int, latency: float, finished: bool = True) -> None:
+        k = i * _N_STATS
+        if not finished:
+            # The latency is at least the elapsed time.
+            latency = max(latency, self._stats[k + _LATENCY])
+            self._stats[k + _LATENCY] = latency
+        elif self._stats[k + _RUNS] == 0:
+            self._stats[k + _LATENCY] = latency
+        else:
+            self._stats[k + _LATENCY] += self.alpha * (
+                latency - self._stats[k + _LATENCY]
+            )
+        self._stats[k + _RUNS] += 1
+
+    def schedule(self) -> List[int]:
+        """
+        Return the indices of children in the order to be run.
+        """
+
+        def priority(i: int) -> float:
+            latency, runs, hits = self.stats(i)
+            return (hits + 1) / (runs + 2) / max(latency, 1e-4)
+
+        return sorted(range(len(self._commanders)), key=priority, reverse=True)
+
+    def _run(
+        self, i: int, keywords: List[str], queue, timeout: Optional[float]
+    ) -> bool:
+        tagged = _TaggingQueue(queue, id(self), i)
+        k = i * _N_STATS
+        if self._stats[k + _RUNS] == 0:
+            # Kept if the search process is terminated before the child finishes.
+            self._stats[k + _LATENCY] = max(self._stats[k + _LATENCY], self.budget)
+        t0 = time.perf_counter()
+        if timeout is None:
+            self._commanders[i].order(keywords, tagged)  # type: ignore
+        else:
+            thread = threading.Thread(
+                target=self._commanders[i].order, args=(keywords, tagged), daemon=True
+            )
+            thread.start()
+            thread.join(max(timeout, 0))
+            if thread.is_alive():
+                self._record_latency(i, time.perf_counter() - t0, finished=False)
+                return False
+        self._record_latency(i, time.perf_counter() - t0)
+        return True
+
+    def order(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        deadline = time.perf_counter() + self.budget
+        deferred = []
+        for i in self.schedule():
+            remaining = deadline - time.perf_counter()
+            if self.stats(i)[_LATENCY] > remaining:
+                deferred.append(i)
+                if self.policy == "skip":
+                    self._stats[i * _N_STATS + _LATENCY] *= self.skip_decay
+                continue
+            if self.policy == "skip":
+                if not self._run(i, keywords, queue, remaining):
+                    return  # The deadline has passed.
+            else:
+                self._run(i, keywords, queue, None)
+        if self.policy == "background":
+            for i in deferred:
+                self._run(i, keywords, queue, None)
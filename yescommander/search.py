@@ -0,0 +1,92 @@
+"""
+This file implements the headless query API, which runs a commander tree without
+the terminal interface.
+"""
+from __future__ import annotations
+
+import heapq
+import threading
+from operator import attrgetter
+from queue import Empty, Queue
+from typing import Any, Iterator, List, Optional, Union
+
+from .core import BaseCommand, BaseCommander
+from .dedup import Deduplicator
+from .frecency import FrecencyStore
+from .query import compile_query
+
+__all__ = ["search", "split_keywords"]
+
+
+def split_keywords(text: str) -> List[str]:
+    """
+    Split the searching text into keywords the same way as `yc` does.
+    """
+    text = text.strip()
+    if len(text) == 0:
+        return []
+    return text.split(" ")
+
+
+class _OrderCancelled(Exception):
+    pass
+
+
+class _ClosingQueue(Queue):
+    # A queue which stops the order putting commands into it once it is closed.
+    closed = False
+
+    def put(self, item: Any, *args: Any, **kwargs: Any) -> None:
+        if self.closed:
+            raise _OrderCancelled()
+        super().put(item, *args, **kwargs)
+
+
+def _order(commander: BaseCommander, keywords: List[str], queue: _ClosingQueue) -> None:
+    try:
+        commander.order(keywords, queue)
+    except _OrderCancelled:
+        pass
+
+
+def search(
+    chief_commander: BaseCommander,
+    keywords: Union[str, List[str]],
+    limit: Optional[int] = None,
+    timeout: Optional[float] = None,
+    frecency: Optional[FrecencyStore] = None,
+) -> Iterator[BaseCommand]:
+    """
+    Order `chief_commander` with `keywords` in the current process and return an
+    iterator over the commands, ranked as in `yc`. With `timeout`, commands given
+    within `timeout` seconds are returned and the rest of the order is abandoned: it
+    keeps running in a daemon thread until its next `queue.put`, which raises an
+    exception to stop it. Commanders should therefore tolerate being stopped at a
+    `put`, and not leave shared state half updated around it.
+    """
+    if isinstance(keywords, str):
+        keywords = split_keywords(keywords)
+    keywords = compile_query(keywords)
+    if len(keywords) == 0:
+        return iter([])
+    queue = _ClosingQueue()
+    if timeout is None:
+        chief_commander.order(keywords, queue)
+    else:
+        thread = threading.Thread(
+            target=_order, args=(chief_commander, keywords, queue), daemon=True
+        )
+        thread.start()
+        thread.join(timeout)
+        queue.closed = True
+    dedup = Deduplicator()
+    try:
+        while True:
+            dedup.add(queue.get_nowait())
+    except Empty:
+        pass
+    cmds = dedup.commands
+    key = attrgetter("score") if frecency is None else frecency.sort_key()
+    if limit is None:
+        return iter(sorted(cmds, key=key, reverse=True))
+    return iter(heapq.nlargest(limit, cmds, key=key))
@@ -0,0 +1,264 @@
+"""
+This file implements `ShardedCommander`, which matches a large number of soldiers in
+parallel over command tables stored in shared memory.
+"""
+from __future__ import annotations
+
+import heapq
+import multiprocessing
+import multiprocessing.pool
+import os
+import pickle
+import signal
+import threading
+import weakref
+from array import array
+from bisect import bisect_right
+from multiprocessing import shared_memory
+from queue import Queue
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from .commander import FileSoldier, Soldier
+from .core import BaseCommand, BaseCommander
+from .query import MatchKeys, Query, compile_query
+
+__all__ = ["ShardedCommander"]
+
+_FIELD_SEP = "\x1e"  # Separates keywords, the field name and the text of a record.
+
+# Attached tables, name -> (records, offsets, lower records, lower offsets, scores).
+# Forked workers inherit it.
+_tables: Dict[str, Tuple[memoryview, ...]] = {}
+_shms: Dict[str, List[shared_memory.SharedMemory]] = {}
+_pools: Dict[str, "multiprocessing.pool.Pool"] = {}
+_pools_lock = threading.Lock()
+
+
+def _register(name: str, shms: List[shared_memory.SharedMemory]) -> None:
+    _shms[name] = shms
+    _tables[name] = (
+        shms[0].buf,
+        shms[1].buf.cast("q"),
+        shms[2].buf,
+        shms[3].buf.cast("q"),
+        shms[4].buf.cast("d"),
+    )
+
+
+def _attach(name: str, shm_names: Tuple[str, ...]) -> None:
+    if name not in _tables:
+        _register(name, [shared_memory.SharedMemory(n) for n in shm_names])
+
+
+def _init_worker(name: str, shm_names: Tuple[str, ...]) -> None:
+    # Exit quietly when the pool is terminated or the reader of the results is gone.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    _attach(name, shm_names)
+
+
+def _keys(record: bytes) -> MatchKeys:
+    kws, field, text = record.decode().split(_FIELD_SEP)
+    return MatchKeys.from_joined(kws, text, field)
+
+
+def _scan(blob: bytes, word: bytes, offsets, base: int, start: int, end: int):
+    # Yield the records of the shard containing `word`.
+    pos = blob.find(word)
+    while pos != -1:
+        i = bisect_right(offsets, base + pos, start, end) - 1
+        r_end = offsets[i + 1] - base
+        if pos + len(word) <= r_end:
+            yield i
+        pos = blob.find(word, r_end if pos + len(word) <= r_end else pos + 1)
+
+
+def _match_shard(
+    args: Tuple[str, int, int, Query, Optional[int]],
+) -> List[Tuple[float, int]]:
+    name, start, end, query, limit = args
+    records, offsets, lower, lower_offsets, scores = _tables[name]
+    words = {t.needle.lower().encode() for t in query.terms if not t.negate}
+    if len(words) > 0:
+        # Only records containing the rarest word of the query can match it, which
+        # are found by scanning the lowercase records of the whole shard.
+        base = lower_offsets[start]
+        blob = lower[base : lower_offsets[end]].tobytes()
+        word = min(words, key=blob.count)
+        candidates: Iterable[int] = _scan(blob, word, lower_offsets, base, start, end)
+    else:
+        candidates = range(start, end)
+    ans = []
+    for i in candidates:
+        if query.match(_keys(records[offsets[i] : offsets[i + 1]].tobytes())):
+            ans.append((scores[i], i))
+    if limit is not None:
+        return heapq.nlargest(limit, ans)
+    return ans
+
+
+def _fork_map(func: Callable[[Any], Any], items: List[Any], n: int) -> Iterator[Any]:
+    # Map `func` over `items` in `n` forked children, which inherit the attached
+    # tables, and yield the results of every child in turn. The children are in the
+    # process group of the caller, so they are terminated along with a search process.
+    children = []
+    for k in range(n):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(r)
+                with os.fdopen(w, "wb") as fp:
+                    pickle.dump([func(x) for x in items[k::n]], fp, -1)
+            finally:
+                os._exit(0)
+        os.close(w)
+        children.append((pid, r))
+    try:
+        for pid, r in children:
+            with os.fdopen(r, "rb") as fp:
+                data = fp.read()
+            os.waitpid(pid, 0)
+            yield from (pickle.loads(data) if data else [])
+    finally:
+        for pid, r in children:
+            try:
+                os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                pass
+
+
+def _release(name: str, pid: int) -> None:
+    if os.getpid() != pid or name not in _tables:
+        return
+    pool = _pools.pop(name, None)
+    if pool is not None:
+        pool.terminate()
+    for view in _tables.pop(name):
+        view.release()
+    for shm in _shms.pop(name):
+        shm.close()
+        shm.unlink()
+
+
+def _records(keys: MatchKeys) -> Tuple[bytes, bytes]:
+    record = _FIELD_SEP.join([keys.keywords, keys.field, keys.text])
+    lower = _FIELD_SEP.join([keys.keywords.lower(), keys.field, keys.text.lower()])
+    return record.encode(), lower.encode()
+
+
+def _offsets(records: List[bytes]) -> bytes:
+    offsets = array("q", [0])
+    for r in records:
+        offsets.append(offsets[-1] + len(r))
+    return offsets.tobytes()
+
+
+class ShardedCommander(BaseCommander):
+    """
+    `ShardedCommander` is in charge of a large list of `Soldier` or `FileSoldier`
+    objects. Their match keys (keywords and commands, as is and in lowercase) are
+    encoded into buffers in `multiprocessing.shared_memory`. For each order, the table
+    is split into shards of `shard_size` soldiers which are matched by a pool of
+    `processes` worker processes, and the best-scored hits of every shard are put into
+    the queue. The pool belongs to the process which creates the commander; forked
+    search processes of `yc` fork their own workers for each order instead. Tables
+    smaller than `min_parallel` are matched in the current process.
+    """
+
+    def __init__(
+        self,
+        soldiers: Sequence[Union[Soldier, FileSoldier]],
+        processes: Optional[int] = None,
+        shard_size: int = 2000,
+        min_parallel: int = 10000,
+        limit: Optional[int] = None,
+    ) -> None:
+        self._soldiers = list(soldiers)
+        self.processes = os.cpu_count() if processes is None else processes
+        self.shard_size = shard_size
+        self.min_parallel = min_parallel
+        self.limit = limit
+
+        pairs = [_records(s.match_keys) for s in self._soldiers]
+        records = [r for r, _ in pairs]
+        lower = [r for _, r in pairs]
+        scores = array("d", [s.score for s in self._soldiers])
+        blobs = [
+            b"".join(records),
+            _offsets(records),
+            b"".join(lower),
+            _offsets(lower),
+            scores.tobytes(),
+        ]
+        shms = [
+            shared_memory.SharedMemory(create=True, size=max(len(b), 1)) for b in blobs
+        ]
+        for shm, b in zip(shms, blobs):
+            shm.buf[: len(b)] = b
+        self._shm_names = tuple(shm.name for shm in shms)
+        self._name = self._shm_names[0]
+        _register(self._name, shms)
+        self._pid = os.getpid()
+        self._finalizer = weakref.finalize(self, _release, self._name, self._pid)
+
+    def __len__(self) -> int:
+        return len(self._soldiers)
+
+    def close(self) -> None:
+        """
+        Release the shared memory of the table.
+        """
+        self._finalizer()
+
+    def _shards(self, query: Query):
+        for start in range(0, len(self._soldiers), self.shard_size):
+            end = min(start + self.shard_size, len(self._soldiers))
+            yield (self._name, start, end, query, self.limit)
+
+    def _pool(self) -> "multiprocessing.pool.Pool":
+        with _pools_lock:
+            pool = _pools.get(self._name)
+            if pool is None:
+                methods = multiprocessing.get_all_start_methods()
+                ctx = multiprocessing.get_context("fork" if "fork" in methods else None)
+                pool = _pools[self._name] = ctx.Pool(
+                    self.processes,
+                    initializer=_init_worker,
+                    initargs=(self._name, self._shm_names),
+                )
+            return pool
+
+    def order(self, keywords: List[str], queue: "Queue[BaseCommand]") -> None:
+        query = compile_query(keywords)
+        if len(self._soldiers) < self.min_parallel or self.processes <= 1:
+            self._put(map(_match_shard, self._shards(query)), queue)
+        elif os.getpid() != self._pid:
+            # The pool cannot be used from another process.
+            shards = list(self._shards(query))
+            n = min(self.processes, len(shards))
+            self._put(_fork_map(_match_shard, shards, n), queue)
+        else:
+            shards = self._shards(query)
+            self._put(self._pool().imap_unordered(_match_shard, shards), queue)
+
+    def _put(self, results, queue: "Queue[BaseCommand]") -> None:
+        if self.limit is None:
+            for hits in results:
+                for _, i in hits:
+                    queue.put(self._soldiers[i])
+            return
+        for _, i in heapq.nlargest(self.limit, (h for hits in results for h in hits)):
+            queue.put(self._soldiers[i])
@@ -1,4 +1,5 @@
 import yescommander as yc
 
 chief_commander: yc.Commander
+search_mode: str
 def main(): ...
@@ -0,0 +1,179 @@
+"""
+This file implements `file_viewer`, which stores commands to open different types of
+files, and `update_file_viewer`, which fills it with a cached probing function.
+"""
+from __future__ import annotations
+
+import hashlib
+import inspect
+import json
+import os
+import shlex
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from .xdg import cache_path
+
+__all__ = ["FileViewer", "file_viewer", "update_file_viewer"]
+
+Viewers = Dict[str, Union[str, List[str]]]
+
+
+def _binary(template: str) -> str:
+    try:
+        return shlex.split(template)[0]
+    except (ValueError, IndexError):
+        return template.split(" ")[0]
+
+
+def _which(template: str) -> Optional[str]:
+    return shutil.which(_binary(template))
+
+
+def _mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+
+class FileViewer(dict):
+    """
+    `FileViewer` maps file types to the commands opening them, where "%s" stands for the
+    file name. A file type could also be given a list of candidate commands with
+    `register`. They are probed in parallel on the first `resolve` of the file type, and
+    the first one whose program is installed is taken.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.candidates: Dict[str, List[str]] = {}
+        self._programs: Dict[str, Tuple[str, int]] = {}
+        self._on_change: Optional[Callable[[], None]] = None
+        self._lock = threading.Lock()
+
+    def register(self, filetype: str, candidates: List[str]) -> None:
+        self.pop(filetype, None)
+        self.candidates[filetype] = list(candidates)
+
+    def update(self, viewers: Viewers) -> None:  # type: ignore
+        for filetype, v in viewers.items():
+            if isinstance(v, str):
+                self.candidates.pop(filetype, None)
+                self[filetype] = v
+            else:
+                self.register(filetype, v)
+
+    def watch(
+        self, programs: Dict[str, Tuple[str, int]], on_change: Callable[[], None]
+    ) -> None:
+        """
+        Call `on_change` if the program `(path, mtime)` of a file type in `programs`
+        has changed when the file type is resolved.
+        """
+        self._programs = dict(programs)
+        self._on_change = on_change
+
+    def resolve(self, filetype: str) -> str:
+        """
+        Return the command to open files of `filetype`, or the default one.
+        """
+        with self._lock:
+            program = self._programs.pop(filetype, None)
+            if program is not None and _mtime(program[0]) != program[1]:
+                self._programs = {}
+                if self._on_change is not None:
+                    self._on_change()
+            if filetype in self.candidates:
+                candidates = self.candidates.pop(filetype)
+                with ThreadPoolExecutor(max(len(candidates), 1)) as pool:
+                    found = list(pool.map(_which, candidates))
+                for template, path in zip(candidates, found):
+                    if path is not None:
+                        self[filetype] = template
+                        break
+            if filetype in self:
+                return self[filetype]
+            return self["default"]
+
+
+file_viewer = FileViewer(default="vim %s")
+
+
+def _cache_key(func: Callable[[], Viewers]) -> str:
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = func.__code__.co_code.hex()
+    return hashlib.sha1(
+        json.dumps([source, os.environ.get("PATH", "")]).encode()
+    ).hexdigest()
+
+
+def _dir_stamps() -> Dict[str, int]:
+    # The mtimes of the `PATH` directories, which change when programs are installed,
+    # removed or replaced.
+    return {p: _mtime(p) for p in os.environ.get("PATH", "").split(os.pathsep) if p}
+
+
+def _programs(viewers: Viewers) -> Dict[str, Tuple[str, int]]:
+    ans = {}
+    for filetype, v in viewers.items():
+        if isinstance(v, str):
+            path = _which(v)
+            if path is not None:
+                ans[filetype] = (path, _mtime(path))
+    return ans
+
+
+def update_file_viewer(mode: str = "cache"):
+    """
+    Decorate a function which returns the viewers of file types (a command or a list
+    of candidate commands for each) to update `file_viewer`. In "cache" mode, its
+    result is cached in `viewer.json` until the source of the function, `PATH` or the
+    directories in `PATH` change. The program of a file type is checked when the file
+    type is first resolved, and the function is run again if it has changed. In
+    "ignore" mode, the function is always run.
+    """
+    if mode not in ("cache", "ignore"):
+        raise ValueError('mode could only be "cache" or "ignore".')
+
+    def w(func):
+        def probe(key: str) -> None:
+            viewers = func()
+            file_viewer.update(viewers)
+            programs = _programs(viewers)
+            viewer_cache = cache_path / "viewer.json"
+            viewer_cache.parent.mkdir(parents=True, exist_ok=True)
+            with viewer_cache.open("w") as fp:
+                cache = {
+                    "key": key,
+                    "stamps": _dir_stamps(),
+                    "viewers": viewers,
+                    "programs": programs,
+                }
+                json.dump(cache, fp)
+            file_viewer.watch(programs, partial(probe, key))
+
+        def c():
+            viewer_cache = cache_path / "viewer.json"
+            key = _cache_key(func)
+            if mode == "cache" and viewer_cache.exists():
+                try:
+                    with viewer_cache.open() as fp:
+                        cache = json.load(fp)
+                    if cache.get("key") == key and _dir_stamps() == cache["stamps"]:
+                        file_viewer.update(cache["viewers"])
+                        programs = {k: tuple(v) for k, v in cache["programs"].items()}
+                        file_viewer.watch(programs, partial(probe, key))
+                        return
+                except (OSError, ValueError, KeyError, TypeError):
+                    pass
+            probe(key)
+
+        return c
+
+    return w